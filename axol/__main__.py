@@ -1,4 +1,5 @@
 from argparse import ArgumentParser
+from pathlib import Path
 
 import axol.crawl
 import axol.report
@@ -14,6 +15,8 @@ def main():
     axol.report.setup_parser(rp)
     ap = sp.add_parser('adhoc')
     axol.adhoc.setup_parser(ap)
+    sp_ = sp.add_parser('rescan', help='Reevaluate ignore decisions for stored results (e.g. after changing filters)')
+    sp_.add_argument('repos', nargs='+', type=Path)
 
     args = p.parse_args()
     if args.mode == 'crawl':
@@ -22,6 +25,10 @@ def main():
         axol.report.run(args)
     elif args.mode == 'adhoc':
         axol.adhoc.run(args)
+    elif args.mode == 'rescan':
+        from axol.storage import rescan_ignores
+        for repo in args.repos:
+            print(repo, rescan_ignores(repo))
     else:
         raise RuntimeError(args.mode)
 
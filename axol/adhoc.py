@@ -5,6 +5,7 @@ from tempfile import TemporaryDirectory
 from typing import Sequence, List
 
 from .common import Query, slugify, logger
+from .core.common import the
 from .crawl import process_query, setup_parser as setup_crawl_parser
 from .report import do_repo
 from .queries import GithubQ, RedditQ, PinboardQ, TwitterQ, HackernewsQ, filter_queries, Query
@@ -18,6 +19,10 @@ SUPPORTED = [
     HackernewsQ,
 ]
 
+def summary_output(outputs: Sequence[Path], tdir: Path) -> Path:
+    return the(p for p in outputs if p.parent == tdir / 'summary')
+
+
 def do_run_one(query: Query, tdir: Path):
     dry = False
     process_query(query, path=tdir, dry=dry)
@@ -26,7 +31,8 @@ def do_run_one(query: Query, tdir: Path):
     for d in ('summary', 'rendered'):
         (tdir / d).mkdir(exist_ok=True, parents=True)
     # TODO rename from do_repo?
-    res = do_repo(repo.with_suffix('.sqlite'), output_dir=tdir, last=None, summary=True)
+    outputs = do_repo(repo.with_suffix('.sqlite'), output_dir=tdir, last=None, summary=True)
+    res = summary_output(outputs, tdir)
     print(f"Rendered summary: {res}")
     print("Opening in browser....")
     check_call(['xdg-open', str(res)])
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+'''
+Adhoc benchmarks on synthetic data, e.g.
+
+    python3 -m axol.benchmarks codec --count 100000
+'''
+import argparse
+import random
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, Iterator, List, Optional, Type, Union, get_type_hints, get_origin, get_args
+
+from .traits import Fors
+
+
+USERS = [f'user_{i}' for i in range(500)]
+TAGS  = [f'tag{i}'   for i in range(200)]
+WORDS = 'the quick brown fox jumps over lazy dog extended mind lifelogging memex knowledge'.split()
+
+
+def _value(field: str, tp, i: int, rnd: random.Random) -> Any:
+    if get_origin(tp) is Union: # Optional
+        [tp] = [a for a in get_args(tp) if a is not type(None)]
+    if get_origin(tp) in (list, List):
+        return rnd.sample(TAGS, k=rnd.randint(0, 5))
+    if tp is datetime:
+        return datetime(year=2020, month=1, day=1, tzinfo=timezone.utc) + timedelta(minutes=i)
+    if tp is int:
+        return rnd.randint(0, 100)
+    if field == 'uid':
+        return str(i)
+    if field in ('link', 'url'):
+        return f'https://example.com/{i // 3}' # some links repeat
+    if field in ('user', 'subreddit'):
+        return rnd.choice(USERS)
+    return ' '.join(rnd.choices(WORDS, k=rnd.randint(3, 30)))
+
+
+def synthetic(rtype: Type, count: int, seed: int=0) -> Iterator[Any]:
+    rnd = random.Random(seed)
+    hints = get_type_hints(rtype)
+    for i in range(count):
+        yield rtype(**{f: _value(f, hints[f], i, rnd) for f in rtype._fields})
+
+
+def sources():
+    for F in Fors:
+        try:
+            rtype = F.Target
+        except ImportError as e:
+            print(f'{F.name}: skipping, {e}')
+            continue
+        yield F.name, rtype
+
+
+def timed(name: str, count: int, f: Callable[[], Any]) -> float:
+    start = time.perf_counter()
+    f()
+    took = time.perf_counter() - start
+    print(f'{name:<30}: {took:6.2f}s, {count / took:10.0f} items/s')
+    return took
+
+
+def bench_codec(count: int) -> None:
+    import json
+    from collections import OrderedDict
+    from .codec import JSON
+    from .jsonify import to_json
+
+    for name, rtype in sources():
+        print(f'--- {name} (decoding via {JSON.backend})')
+        jsons = [to_json(r) for r in synthetic(rtype, count)]
+
+        timed('encode, json.dumps(OrderedDict)', count, lambda: [json.dumps(OrderedDict(sorted(j.items()))) for j in jsons])
+        timed('encode, codec'                  , count, lambda: [JSON.encode(j) for j in jsons])
+        blobs = [JSON.encode(j) for j in jsons]
+        assert blobs == [json.dumps(OrderedDict(sorted(j.items()))) for j in jsons]
+
+        timed('decode, json.loads'             , count, lambda: [json.loads(b) for b in blobs])
+        timed('decode, codec'                  , count, lambda: [JSON.decode(b) for b in blobs])
+
+
+def bench_blob_formats(count: int) -> None:
+    from .codec import codec_for
+    from .database import blob_meta
+    from .jsonify import to_json, JsonTrait
+
+    for name, rtype in sources():
+        print(f'--- {name}')
+        from_json = JsonTrait.for_(rtype).from_json
+        jsons = [to_json(r) for r in synthetic(rtype, count)]
+        for fmt in ('json', 'msgpack'):
+            codec = codec_for(blob_meta(fmt, jsons))
+            blobs = [codec.encode(j) for j in jsons]
+            size = sum(len(b) for b in blobs)
+            print(f'{fmt:<8}: {size / 10 ** 6:.1f} Mb')
+            timed(f'{fmt}, decode'          , count, lambda: [codec.decode(b) for b in blobs])
+            timed(f'{fmt}, decode+from_json', count, lambda: [from_json(codec.decode(b)) for b in blobs])
+
+
+def bench_interning(count: int) -> None:
+    import tracemalloc
+    from .codec import JSON
+    from .core.kjson import ToFromJson
+    from .jsonify import to_json, JsonTrait
+
+    for name, rtype in sources():
+        print(f'--- {name}')
+        Trait = JsonTrait.for_(rtype)
+        blobs = [JSON.encode(to_json(r)) for r in synthetic(rtype, count)]
+        for interned in [(), Trait.interned]:
+            tofrom = ToFromJson(rtype, as_dates=['when'], interned=interned)
+            tracemalloc.start()
+            items = [tofrom.from_(JSON.decode(b)) for b in blobs]
+            current, _ = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(f'interned {str(interned):<20}: {current / 10 ** 6:6.1f} Mb, {current / len(items):6.0f} bytes/item')
+            del items
+
+
+def bench_reddit_filters(count: int) -> None:
+    from .filters import Excluder
+    from .traits import ForReach
+    from config import EXCLUDED_SUBREDDITS
+
+    filters = [f for fs in EXCLUDED_SUBREDDITS() for f in fs]
+    rnd = random.Random(0)
+    # sprinkle some excluded items in
+    items = [
+        r._replace(subreddit='gaming') if rnd.random() < 0.01 else r
+        for r in synthetic(ForReach.Target, count)
+    ]
+    excluder = Excluder(filters)
+
+    def naive():
+        return [next((f.reason for f in filters if f.matches(i)), None) for i in items]
+    def compiled():
+        return [excluder.reason(i) for i in items]
+    print(f'{len(filters)} filters')
+    timed('per filter', count, naive)
+    timed('compiled'  , count, compiled)
+    assert naive() == compiled()
+
+
+def bench_dispatch(count: int) -> None:
+    from .trait import AbsTrait, pull2
+    from .traits import IgnoreTrait, ignore_result, For
+
+    # how pull2 used to work, resolving the trait on every call
+    def uncached(Trait, name):
+        def _m(obj, *args, **kwargs):
+            return getattr(Trait.for_(obj), name)(obj, *args, **kwargs)
+        return _m
+    ignore_uncached = uncached(IgnoreTrait, 'ignore')
+
+    for name, rtype in sources():
+        if name not in ('twitter', 'hackernews'): # others do actual work in ignore
+            continue
+        print(f'--- {name}')
+        items = list(synthetic(rtype, count))
+        timed('ignore, uncached dispatch', count, lambda: [ignore_uncached(i) for i in items])
+        timed('ignore, cached dispatch'  , count, lambda: [ignore_result(i)   for i in items])
+        timed('For, uncached'            , count, lambda: [For.__wrapped__(rtype) for i in items])
+        timed('For, cached'              , count, lambda: [For(rtype)         for i in items])
+
+
+def bench_formatters(count: int) -> None:
+    from .report import get_format
+
+    for name, rtype in sources():
+        print(f'--- {name}')
+        groups = [[(None, i)] for i in synthetic(rtype, count)]
+        Dom, Template = get_format(rtype, 'dom'), get_format(rtype, 'template')
+        timed('dominate', count, lambda: [str(Dom     .format(g)) for g in groups])
+        timed('template', count, lambda: [str(Template.format(g)) for g in groups])
+        assert [str(Dom.format(g)) for g in groups[:1000]] == [str(Template.format(g)) for g in groups[:1000]]
+
+
+def bench_summary(count: int) -> None:
+    from .report import CumulativeBase
+
+    for name, rtype in sources():
+        print(f'--- {name}')
+        Cumulative = CumulativeBase.for_(rtype)
+        items = list(synthetic(rtype, count))
+        timed('summarise', count, lambda: Cumulative.summarise(items))
+
+
+BENCHMARKS: Dict[str, Callable[[int], None]] = {
+    'codec'       : bench_codec,
+    'blob_formats': bench_blob_formats,
+    'interning'   : bench_interning,
+    'reddit_filters': bench_reddit_filters,
+    'dispatch'    : bench_dispatch,
+    'formatters'  : bench_formatters,
+    'summary'     : bench_summary,
+}
+
+
+def main() -> None:
+    p = argparse.ArgumentParser()
+    p.add_argument('benchmark', choices=list(BENCHMARKS))
+    p.add_argument('--count', type=int, default=100_000)
+    args = p.parse_args()
+    BENCHMARKS[args.benchmark](args.count)
+
+
+if __name__ == '__main__':
+    main()
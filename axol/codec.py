@@ -0,0 +1,138 @@
+import json
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, Optional, Sequence, Tuple, Union
+
+Json = Dict[str, Any]
+Blob = Union[str, bytes]
+
+
+# NOTE: stored blobs are used for deduplication (see DbWriter), so encoding has to stay
+# byte-for-byte what json.dumps(OrderedDict(sorted(j.items()))) used to produce.
+# orjson/msgspec can't do that (compact separators, no ensure_ascii), so they are only used for decoding.
+# Only top level keys are sorted, same as before (sort_keys=True would sort nested dicts as well).
+_encoder = json.JSONEncoder()
+
+
+def _json_loads() -> Tuple[str, Callable[[Blob], Json]]:
+    try:
+        import orjson # type: ignore
+    except ModuleNotFoundError:
+        pass
+    else:
+        def orjson_loads(s: Blob) -> Json:
+            try:
+                return orjson.loads(s)
+            except orjson.JSONDecodeError:
+                # e.g. lone surrogates, stdlib is more lenient about them
+                return json.loads(s)
+        return 'orjson', orjson_loads
+
+    try:
+        import msgspec # type: ignore
+    except ModuleNotFoundError:
+        pass
+    else:
+        decoder = msgspec.json.Decoder()
+        def msgspec_loads(s: Blob) -> Json:
+            try:
+                return decoder.decode(s)
+            except msgspec.DecodeError:
+                return json.loads(s)
+        return 'msgspec', msgspec_loads
+
+    return 'json', json.loads
+
+
+class JsonCodec:
+    name = 'json'
+
+    def __init__(self) -> None:
+        self.backend, self._loads = _json_loads()
+
+    def encode(self, j: Json) -> Blob:
+        return _encoder.encode(dict(sorted(j.items())))
+
+    def decode(self, blob: Blob) -> Json:
+        return self._loads(blob)
+
+
+JSON = JsonCodec()
+
+
+EPOCH       = datetime(year=1970, month=1, day=1)
+EPOCH_UTC   = EPOCH.replace(tzinfo=timezone.utc)
+MICROSECOND = timedelta(microseconds=1)
+
+# datetimes are stored as [epoch microseconds, utc offset in seconds (None for naive datetimes)]
+# so they can be restored (and formatted back into exactly the same isoformat string)
+DtTuple = Tuple[int, Optional[int]]
+
+
+def _dt2tuple(s: str) -> DtTuple:
+    dt = datetime.fromisoformat(s)
+    offset = dt.utcoffset()
+    if offset is None:
+        return ((dt - EPOCH) // MICROSECOND, None)
+    else:
+        assert offset % timedelta(seconds=1) == timedelta(0), s
+        return ((dt - EPOCH_UTC) // MICROSECOND, offset // timedelta(seconds=1))
+
+
+def _tuple2dt(t: Sequence) -> datetime:
+    us, offset = t
+    if offset is None:
+        return EPOCH + us * MICROSECOND
+    tz = timezone(timedelta(seconds=offset))
+    return (EPOCH_UTC + us * MICROSECOND).astimezone(tz)
+
+
+class MsgpackCodec:
+    """
+    Stores each blob as a msgpack array in the order of 'fields' (all results in a database have the same type).
+    Date fields are decoded straight into datetimes, so from_json doesn't have to parse them.
+    """
+    name = 'msgpack'
+
+    def __init__(self, fields: Sequence[str], dates: Sequence[str]) -> None:
+        import msgpack # type: ignore
+        self.fields = list(fields)
+        self.dates  = list(dates)
+        self._sfields = set(self.fields)
+        self._idates = [self.fields.index(d) for d in self.dates]
+        self._packb   = msgpack.Packer(use_bin_type=True).pack
+        self._unpackb = lambda b: msgpack.unpackb(b, raw=False, use_list=True)
+
+    def encode(self, j: Json) -> Blob:
+        if j.keys() != self._sfields:
+            raise RuntimeError(f"{sorted(j.keys())} don't match stored fields {self.fields}. Convert the database back to json?")
+        row = [j[f] for f in self.fields]
+        for i in self._idates:
+            row[i] = _dt2tuple(row[i])
+        return self._packb(row)
+
+    def decode(self, blob: Blob) -> Json:
+        row = self._unpackb(blob)
+        for i in self._idates:
+            row[i] = _tuple2dt(row[i])
+        return dict(zip(self.fields, row))
+
+
+Codec = Union[JsonCodec, MsgpackCodec]
+BLOB_FORMATS = (JsonCodec.name, MsgpackCodec.name)
+
+
+def jsonable(j: Json) -> Json:
+    """
+    Inverse to MsgpackCodec decoding datetimes, so the result can be stored as json again
+    """
+    return {k: v.isoformat() if isinstance(v, datetime) else v for k, v in j.items()}
+
+
+def codec_for(meta: Json) -> Codec:
+    fmt = meta.get('blob_format', JsonCodec.name)
+    if fmt == JsonCodec.name:
+        return JSON
+    elif fmt == MsgpackCodec.name:
+        return MsgpackCodec(fields=meta['fields'], dates=meta['dates'])
+    else:
+        raise RuntimeError(f'Unknown blob format: {fmt}')
@@ -22,7 +22,7 @@ logger = LazyLogger('axol', level=logging.INFO)
 
 
 
-Filter = Any
+from .filters import Filter
 
 class Query(Protocol):
     searcher: Type[Any]
@@ -1,33 +1,99 @@
-from contextlib import contextmanager
+import re
+from typing import Any, Dict, Sequence, Tuple
 
 import dominate
+from dominate.util import escape
 
 
-# TODO shit. contextmanager is bound to thread...
-# https://github.com/Knio/dominate/issues/108
-# TODO perhaps post on github?
-# TODO FIXME implement a test or something...
-# TODO generate random?
-# TODO remove context after finishing?
-@contextmanager
-def hack_html_context(uid: str):
-    domtag = dominate.dom_tag # type: ignore
-    prev = domtag._get_thread_context
-    def hacked_thread_contex(uid=uid):
-        return uid
-
-    try:
-        domtag._get_thread_context = hacked_thread_contex
-        yield
-    finally:
-        domtag._get_thread_context = prev
-
-
-@contextmanager
-def adhoc_html(uid: str, cb):
-    with hack_html_context(uid=uid):
-        with dominate.tags.html() as html: # type: ignore
-            # TODO not sure if original html would ever be useful?
-            yield # TODO needs a test..
-        # TODO meh..
-        cb(html.children)
+# NOTE: formatters construct elements explicitly (e.g. res.add(T.div(...))) instead of using 'with' blocks,
+# so they don't depend on dominate's context stack and can run in threads. See https://github.com/Knio/dominate/issues/108
+
+
+class prerendered(dominate.dom_tag.dom_tag): # type: ignore
+    '''
+    Tag that renders as whatever render(indent_level, indent_str, pretty, xhtml) returns, e.g. html cached from the previous runs.
+    Meant for block level fragments.
+    '''
+    is_inline = False
+
+    # NOTE: keyword only, otherwise dominate treats the tag as a decorator
+    def __init__(self, *, render) -> None:
+        super().__init__()
+        self._render_html = render
+
+    def _render(self, sb, indent_level, indent_str, pretty, xhtml):
+        sb.append(self._render_html(indent_level, indent_str, pretty, xhtml))
+        return sb
+
+
+_MARKER = '\x00stream-marker\x00'
+
+class _Marker(dominate.dom_tag.dom_tag): # type: ignore
+    is_inline = False
+
+    def _render(self, sb, *args, **kwargs):
+        sb.append(_MARKER)
+        return sb
+
+
+def stream_document(doc, fo, blocks, indent: str='  ') -> None:
+    '''
+    Writes doc with blocks appended to it, rendering blocks one at a time, so the whole tree never needs to be in memory.
+    Output is exactly the same as doc.add(*blocks); fo.write(doc.render()).
+    '''
+    dom_tag = dominate.dom_tag.dom_tag # type: ignore
+    marker = _Marker()
+    doc.add(marker)
+    with_marker = doc.render(indent=indent)
+    marker.parent.remove(marker)
+    without = doc.render(indent=indent)
+
+    head, _, tail = with_marker.partition(_MARKER)
+    nl = head.rindex('\n')
+    prefix = head[:nl]
+    level = (len(head) - nl - 1) // len(indent)
+    assert without.startswith(prefix)
+    # if nothing non-inline ends up in the document, container closes differently
+    inline_tail = without[len(prefix):]
+
+    fo.write(prefix)
+    inline = True
+    for block in blocks:
+        assert isinstance(block, dom_tag), block
+        sb = []
+        if not block.is_inline:
+            inline = False
+            sb.append('\n')
+            sb.append(indent * level)
+        block._render(sb, level, indent, True, False)
+        fo.write(''.join(sb))
+    fo.write(inline_tail if inline else tail)
+
+
+class Template:
+    '''
+    Html snippet with str.format placeholders, written the way dominate pretty prints it at indentation level 0 (with two space indent).
+    Values are escaped the same way dominate escapes them, apart from the raw fields (e.g. nested snippets that are already rendered).
+    '''
+    def __init__(self, html: str, raw: Sequence[str]=()) -> None:
+        self.html = html
+        self.raw = frozenset(raw)
+        self._compiled: Dict[Tuple[int, str], str] = {}
+
+    def at(self, level: int, indent: str='  ') -> str:
+        key = (level, indent)
+        res = self._compiled.get(key)
+        if res is None:
+            # NOTE: values are substituted after reindenting, so newlines in them aren't affected
+            res = re.sub(r'\n((?:  )*)', lambda m: '\n' + indent * (level + len(m.group(1)) // 2), self.html)
+            self._compiled[key] = res
+        return res
+
+    def render(self, level: int, indent: str='  ', **kwargs: Any) -> str:
+        return self.at(level, indent).format_map({
+            k: v if k in self.raw else escape(str(v)) for k, v in kwargs.items()
+        })
+
+
+def nl(level: int, indent: str='  ') -> str:
+    return '\n' + indent * level
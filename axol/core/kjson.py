@@ -1,4 +1,5 @@
-from typing import List
+import sys
+from typing import Any, Dict, List, Sequence, Tuple
 
 
 from datetime import datetime
@@ -14,11 +15,34 @@ def _str2date(s: str) -> datetime:
     return dateutil.parser.parse(s)
 
 
+class Interner:
+    '''
+    Shares repetitive values (e.g. usernames or tag lists) between decoded objects to save memory
+    '''
+    def __init__(self) -> None:
+        self.lists: Dict[Tuple[str, ...], List[str]] = {}
+
+    def __call__(self, v: Any) -> Any:
+        if isinstance(v, str):
+            return sys.intern(v)
+        if isinstance(v, list) and all(isinstance(x, str) for x in v):
+            key = tuple(map(sys.intern, v))
+            res = self.lists.get(key)
+            if res is None:
+                # NOTE: the list is shared, so it shouldn't be mutated
+                res = list(key)
+                self.lists[key] = res
+            return res
+        return v
+
+
 class ToFromJson:
     # TODO additional way to specify date fields?
-    def __init__(self, cls, as_dates: List[str]) -> None:
+    def __init__(self, cls, as_dates: List[str], interned: Sequence[str]=()) -> None:
         self.cls = cls
         self.dates = as_dates
+        self.interned = interned
+        self.interner = Interner()
 
     def to(self, obj):
         res = obj._asdict()
@@ -37,7 +61,10 @@ class ToFromJson:
         for k in jj:
             v = jj[k]
             if k in self.dates:
-                res[k] = _str2date(v)
+                # binary blobs are decoded into datetimes straightaway
+                res[k] = v if isinstance(v, datetime) else _str2date(v)
+            elif k in self.interned:
+                res[k] = self.interner(v)
             else:
                 res[k] = v
         return self.cls(**res)
@@ -3,10 +3,13 @@ import argparse
 from pathlib import Path
 import logging
 import sys
+from typing import Any, Dict
 
 from .common import logger, Query, slugify
 from .jsonify import to_json
 from .database import DbWriter
+from .traits import For, UpdateTrait
+from .core.common import the
 
 from config import get_queries, DATABASES
 
@@ -20,13 +23,18 @@ def process_query(q: Query, dry: bool, path: Path) -> None:
         logger.info(f'dry run! would have searched for {qs} via {searcher}')
         return
 
-    results = searcher.search_all(qs)
+    results = list(searcher.search_all(qs))
     jsons = [to_json(r) for r in results]
 
 
     dbstem = slugify(q.repo_name) # TODO FIXME slugify_in?
     db_path = path / (dbstem + '.sqlite')
-    dbw = DbWriter(db_path=db_path)
+    meta: Dict[str, Any] = {}
+    if len(results) > 0:
+        # NOTE: using the actual results, Query doesn't have to know about its source
+        rtype = the({type(r) for r in results})
+        meta.update(source=For(rtype).name, schema=rtype._fields, tracked=UpdateTrait.for_(rtype).tracked)
+    dbw = DbWriter(db_path=db_path, queries=qs, **meta)
     dbw.commit(jsons, query=str(qs))
 
 
@@ -1,37 +1,59 @@
 #!/usr/bin/env python3
+import argparse
+import hashlib
 import json
 from datetime import datetime
-from collections import OrderedDict
 from itertools import islice, groupby
 from pathlib import Path
-from typing import Optional, Iterator, Tuple, Dict, Iterable
+from typing import Optional, Iterator, Tuple, Dict, Iterable, Any, List, Callable, Sequence
 
 from .common import ichunks, Query
+from .codec import JSON, BLOB_FORMATS, Blob, Codec, MsgpackCodec, codec_for, jsonable
 
 import pytz
 import sqlalchemy # type: ignore
 from sqlalchemy import Table, Column # type: ignore
-from sqlalchemy import func, select, text # type: ignore
+from sqlalchemy import func, select, text, literal_column # type: ignore
+from sqlalchemy.schema import CreateTable # type: ignore
 
 
 Revision = str
 Json = Dict
 Jsons = Iterable[Json]
+# (rowid, uid, revision)
+RowKey = Tuple[int, str, Revision]
 
 
 from .core.klogging import LazyLogger
 logger = LazyLogger('axol.database', level='info')
 
 
+# hash of the tracked fields (see UpdateTrait), stored along with each row so updates can be detected without decoding blobs
+# NOTE: values are json values, so datetimes are hashed as their isoformat (same as they are stored)
+def tracked_hash(values: Sequence[Any]) -> bytes:
+    key = repr(tuple(v.isoformat() if isinstance(v, datetime) else v for v in values))
+    return hashlib.blake2b(key.encode('utf8'), digest_size=8).digest()
+
+
 class DbHelper:
+    ID   = 'id'
     UID  = 'uid'
     DT   = 'dt'
     BLOB = 'blob'
+    THASH = 'thash'
 
     DT_COL  = 'dt'
     LOG_COL = 'log'
 
-    def __init__(self, db_path: Path) -> None:
+    KEY_COL   = 'key'
+    VALUE_COL = 'value'
+
+    RESULT_COL = 'result'
+    REASON_COL = 'reason'
+
+    # migrate: create missing tables and bring older databases up to date (only done by writers and explicit commands)
+    # otherwise older schemas are handled as is, so reading never rewrites the database
+    def __init__(self, db_path: Path, migrate: bool=False) -> None:
         self.engine = sqlalchemy.create_engine(f'sqlite:///{db_path}')
         self.connection = self.engine.connect()
         meta = sqlalchemy.MetaData(self.connection)
@@ -40,13 +62,17 @@ class DbHelper:
         self.results = Table(
             'results',
             meta,
+            # NOTE: explicit INTEGER PRIMARY KEY is an alias for rowid, otherwise VACUUM may renumber the rows
+            # ignore decisions refer to the rows by it, so it has to be stable
+            Column(self.ID  , sqlalchemy.Integer, primary_key=True),
             Column(self.UID , sqlalchemy.String),
             Column(self.DT  , sqlalchemy.String),
             Column(self.BLOB, sqlalchemy.String),
+            # tracked_hash of the row, only valid for the 'tracked' fields stored in meta (null if unknown)
+            Column(self.THASH, sqlalchemy.LargeBinary, nullable=True),
             # NOTE: using unique index for blob doesn't give any benefit?
-            # TODO later, might worth it for DT, UID? or primary key?
+            # TODO later, might worth it for DT, UID?
         )
-        self.results.create(self.connection, checkfirst=True)
 
         self.logs = Table(
             'logs',
@@ -54,7 +80,123 @@ class DbHelper:
             Column(self.DT_COL , sqlalchemy.String),
             Column(self.LOG_COL, sqlalchemy.String),
         )
-        self.logs.create(self.connection, checkfirst=True)
+
+        # database wide settings, e.g. blob format. values are json
+        self.meta = Table(
+            'meta',
+            meta,
+            Column(self.KEY_COL  , sqlalchemy.String, primary_key=True),
+            Column(self.VALUE_COL, sqlalchemy.String),
+        )
+
+        # IgnoreTrait decisions for rows of results, by results.id (null reason means not ignored)
+        # only valid for the ignore config stored in meta, see save_ignores
+        self.ignores = Table(
+            'ignores',
+            meta,
+            Column(self.RESULT_COL, sqlalchemy.Integer, primary_key=True),
+            Column(self.REASON_COL, sqlalchemy.String, nullable=True),
+        )
+
+        if migrate:
+            self._migrate()
+        self.tables = {name for (name,) in self.connection.execute(text("SELECT name FROM sqlite_master WHERE type = 'table'"))}
+        self.columns = {r[1] for r in self.connection.execute(text('PRAGMA table_info(results)'))}
+
+    def _migrate(self) -> None:
+        for table in [self.results, self.logs, self.meta, self.ignores]:
+            table.create(self.connection, checkfirst=True)
+        columns = {r[1] for r in self.connection.execute(text('PRAGMA table_info(results)'))}
+        if self.THASH not in columns:
+            # older databases
+            logger.info('%s: adding %s column to results', self.engine.url.database, self.THASH)
+            self.connection.execute(text(f'ALTER TABLE results ADD COLUMN {self.THASH} BLOB'))
+        if self.ID not in columns:
+            self._migrate_ids()
+
+    @property
+    def has_ids(self) -> bool:
+        return self.ID in self.columns
+
+    @property
+    def has_hashes(self) -> bool:
+        return self.THASH in self.columns
+
+    @property
+    def thash_col(self) -> str:
+        return 'results.thash' if self.has_hashes else 'NULL'
+
+    def _migrate_ids(self) -> None:
+        # older databases didn't have the id column, so rowids weren't stable
+        # the table is rebuilt keeping the current rowids as ids, so stored ignore decisions stay valid
+        # NOTE: it's idempotent, so it's fine if another process migrated the database in the meantime
+        create = str(CreateTable(self.results).compile(self.engine)).strip()
+        logger.info('%s: adding id column to results', self.engine.url.database)
+        self.connection.connection.executescript(f'''
+BEGIN IMMEDIATE;
+ALTER TABLE results RENAME TO results_old;
+{create};
+INSERT INTO results ({self.ID}, {self.UID}, {self.DT}, {self.BLOB}, {self.THASH})
+    SELECT rowid, {self.UID}, {self.DT}, {self.BLOB}, {self.THASH} FROM results_old;
+DROP TABLE results_old;
+COMMIT;
+        ''')
+
+    def get_meta(self) -> Dict[str, Any]:
+        if 'meta' not in self.tables:
+            return {}
+        return {
+            k: json.loads(v) for k, v in self.connection.execute(select([self.meta.c.key, self.meta.c.value]))
+        }
+
+    def set_meta(self, **kwargs: Any) -> None:
+        self.connection.execute(self.meta.insert().prefix_with('OR REPLACE'), [{
+            self.KEY_COL  : k,
+            self.VALUE_COL: json.dumps(v),
+        } for k, v in kwargs.items()])
+
+    def hashes_valid(self, tracked: Sequence[str]) -> bool:
+        return self.has_hashes and self.get_meta().get('tracked') == list(tracked)
+
+    def reset_hashes(self, tracked: Sequence[str]) -> None:
+        # stored hashes were computed for different fields
+        self.connection.execute(self.results.update().values({self.THASH: None}))
+        self.set_meta(tracked=list(tracked))
+
+    def save_hashes(self, tracked: Sequence[str], hashes: Dict[int, bytes]) -> None:
+        if not self.has_hashes:
+            logger.info("%s: not migrated, can't store tracked hashes (see 'migrate')", self.engine.url.database)
+            return
+        with self.connection.begin():
+            if not self.hashes_valid(tracked):
+                self.reset_hashes(tracked)
+            for chunk in ichunks(hashes.items(), n=1000):
+                self.connection.execute(
+                    text(f'UPDATE results SET {self.THASH} = :thash WHERE rowid = :rowid'),
+                    [{'rowid': rowid, 'thash': h} for rowid, h in chunk],
+                )
+
+    def ignores_valid(self, config: str) -> bool:
+        # NOTE: without the id column rowids aren't stable, so the decisions can't be trusted
+        return self.has_ids and 'ignores' in self.tables and self.get_meta().get('ignore_config') == config
+
+    def save_ignores(self, config: str, decisions: Dict[int, Optional[str]]) -> None:
+        if not self.has_ids:
+            logger.info("%s: not migrated, can't store ignore decisions (see 'migrate')", self.engine.url.database)
+            return
+        with self.connection.begin():
+            if not self.ignores_valid(config):
+                self.connection.execute(self.ignores.delete())
+                self.set_meta(ignore_config=config)
+            for chunk in ichunks(decisions.items(), n=1000):
+                self.connection.execute(self.ignores.insert().prefix_with('OR REPLACE'), [{
+                    self.RESULT_COL: rowid,
+                    self.REASON_COL: reason,
+                } for rowid, reason in chunk])
+
+    @property
+    def codec(self) -> Codec:
+        return codec_for(self.get_meta())
 
     def close(self):
         # TODO engine?
@@ -70,27 +212,227 @@ class DbReader:
         self.repo = repo; assert self.repo.is_file(), self.repo
 
 
-    def iter_versions(self, last=None) -> Iterator[Tuple[Revision, datetime, Jsons]]:
-        assert last is None # not sure if I need it??
+    # after/upto: only return revisions in (after, upto] range
+    def iter_rows(self, after: Optional[Revision]=None, upto: Optional[Revision]=None) -> Iterator[Tuple[Revision, datetime, List['Row']]]:
         # TODO make up revisions??
         # TODO how to open in read only mode?
         dbh = DbHelper(db_path=self.repo)
 
         results = dbh.results
-
-        cursor = dbh.connection.execute(results.select().order_by(results.c.dt))
-        for dts, group in groupby(cursor, key=lambda row: row[1]): # TODO meh, hardcoded..
+        codec = dbh.codec
+
+        query = select([ROWID, results.c.uid, results.c.dt, results.c.blob, literal_column(dbh.thash_col)])
+        if after is not None:
+            query = query.where(results.c.dt > after)
+        if upto is not None:
+            query = query.where(results.c.dt <= upto)
+        cursor = dbh.connection.execute(query.order_by(results.c.dt, ROWID))
+        for dts, group in groupby(cursor, key=lambda row: row[2]): # TODO meh, hardcoded..
             revision = dts # meh
             dt = datetime.fromisoformat(dts)
-            jsons = [json.loads(g[2]) for g in group]
-            yield revision, dt, jsons
+            rows = [Row(*g, codec=codec) for g in group]
+            yield revision, dt, rows
+
+        dbh.close()
+
+    def iter_versions(self, last=None) -> Iterator[Tuple[Revision, datetime, Jsons]]:
+        assert last is None # not sure if I need it??
+        for revision, dt, rows in self.iter_rows():
+            yield revision, dt, [r.json for r in rows]
+
+    def first_seen(self, after: Optional[Revision]=None, upto: Optional[Revision]=None, skip: Callable[[str], bool]=lambda uid: False) -> List[RowKey]:
+        """
+        For each uid, (rowid, uid, dt) of rows from the revision it first appeared in (within the range), ordered by (dt, rowid)
+        Doesn't read the blobs.
+        """
+        dbh = DbHelper(db_path=self.repo)
+        cond = _range_cond(after=after, upto=upto)
+        # NOTE: a join against GROUP BY subquery ends up quadratic without an index, window function is n log n
+        res = [(rowid, uid, dt) for rowid, uid, dt in dbh.connection.execute(text(f'''
+SELECT rowid, uid, dt FROM (
+    SELECT rowid, uid, dt, MIN(dt) OVER (PARTITION BY uid) AS first_dt FROM results WHERE {cond}
+) WHERE dt = first_dt
+ORDER BY dt, rowid;
+        '''), after=after, upto=upto) if not skip(uid)]
+        dbh.close()
+        return res
+
+    def row_keys(self, after: Optional[Revision]=None, upto: Optional[Revision]=None) -> List[RowKey]:
+        """
+        (rowid, uid, dt) of all rows (within the range), ordered by (dt, rowid)
+        """
+        dbh = DbHelper(db_path=self.repo)
+        cond = _range_cond(after=after, upto=upto)
+        res = [(rowid, uid, dt) for rowid, uid, dt in dbh.connection.execute(text(f'''
+SELECT rowid, uid, dt FROM results WHERE {cond} ORDER BY dt, rowid;
+        '''), after=after, upto=upto)]
+        dbh.close()
+        return res
+
+    # ignore_config: if passed and matches the stored one, rows come with cached ignore decisions
+    def iter_keyed_rows(self, keys: Iterable[RowKey], ignore_config: Optional[str]=None) -> Iterator['Row']:
+        """
+        Rows for the keys returned by first_seen/row_keys, in the same order
+        """
+        dbh = DbHelper(db_path=self.repo)
+        codec = dbh.codec
+        cols, join = _ignores_join(dbh, ignore_config)
+        for chunk in ichunks(keys, n=500):
+            rest = {rowid: rest for rowid, *rest in dbh.connection.execute(text(f'''
+SELECT results.rowid, results.blob, {dbh.thash_col}, {cols} FROM results {join}
+WHERE results.rowid IN ({', '.join(str(rowid) for rowid, _, _ in chunk)})
+            '''))}
+            for rowid, uid, dt in chunk:
+                yield Row(rowid, uid, dt, *rest[rowid], codec=codec)
+        dbh.close()
+
+    def iter_first_seen(self, after: Optional[Revision]=None, upto: Optional[Revision]=None, skip: Callable[[str], bool]=lambda uid: False) -> Iterator['Row']:
+        """
+        For each uid, only rows from the revision it first appeared in (within the range), ordered by (dt, rowid)
+        Blobs are only read for uids that aren't skipped.
+        """
+        yield from self.iter_keyed_rows(self.first_seen(after=after, upto=upto, skip=skip))
+
+    def iter_uid_rows(self, uids: Iterable[str], after: Optional[Revision]=None, upto: Optional[Revision]=None, ignore_config: Optional[str]=None) -> Iterator['Row']:
+        """
+        All rows for the specified uids (within the range), ordered by (dt, rowid)
+        """
+        dbh = DbHelper(db_path=self.repo)
+        codec = dbh.codec
+        cond = _range_cond(after=after, upto=upto)
+        cols, join = _ignores_join(dbh, ignore_config)
+        rows = []
+        # sqlite has a limit on number of variables
+        for chunk in ichunks(uids, n=500):
+            cursor = dbh.connection.execute(text(f'''
+SELECT results.rowid, uid, dt, blob, {dbh.thash_col}, {cols} FROM results {join}
+WHERE {cond} AND uid IN ({', '.join(f':u{i}' for i in range(len(chunk)))})
+            '''), after=after, upto=upto, **{f'u{i}': u for i, u in enumerate(chunk)})
+            rows.extend(cursor)
+        dbh.close()
+        rows.sort(key=lambda r: (r[2], r[0]))
+        for r in rows:
+            yield Row(*r, codec=codec)
+
+    def row_hashes(self, tracked: Sequence[str], after: Optional[Revision]=None, upto: Optional[Revision]=None) -> List[Tuple[int, str, Revision, Optional[bytes]]]:
+        """
+        (rowid, uid, dt, tracked hash) of all rows (within the range), ordered by (dt, rowid)
+        Hash is None if it isn't stored or was computed for different tracked fields. Doesn't read the blobs.
+        """
+        dbh = DbHelper(db_path=self.repo)
+        valid = dbh.hashes_valid(tracked)
+        cond = _range_cond(after=after, upto=upto)
+        res = [(rowid, uid, dt, thash if valid else None) for rowid, uid, dt, thash in dbh.connection.execute(text(f'''
+SELECT rowid, uid, dt, {dbh.thash_col} FROM results WHERE {cond} ORDER BY dt, rowid;
+        '''), after=after, upto=upto)]
+        dbh.close()
+        return res
 
+    def hashes_valid(self, tracked: Sequence[str]) -> bool:
+        dbh = DbHelper(db_path=self.repo)
+        res = dbh.hashes_valid(tracked)
         dbh.close()
+        return res
+
+    def save_hashes(self, tracked: Sequence[str], hashes: Dict[int, bytes]) -> None:
+        dbh = DbHelper(db_path=self.repo)
+        dbh.save_hashes(tracked, hashes)
+        dbh.close()
+
+    def save_ignores(self, config: str, decisions: Dict[int, Optional[str]]) -> None:
+        dbh = DbHelper(db_path=self.repo)
+        dbh.save_ignores(config, decisions)
+        dbh.close()
+
+    def get_meta(self) -> Dict[str, Any]:
+        dbh = DbHelper(db_path=self.repo)
+        meta = dbh.get_meta()
+        dbh.close()
+        return meta
+
+    def latest_revision(self) -> Optional[Revision]:
+        dbh = DbHelper(db_path=self.repo)
+        results = dbh.results
+        [(res,)] = dbh.connection.execute(select([func.max(results.c.dt)]))
+        dbh.close()
+        return res
+
+    def count(self, upto: Optional[Revision]=None) -> int:
+        dbh = DbHelper(db_path=self.repo)
+        results = dbh.results
+        query = select([func.count()]).select_from(results)
+        if upto is not None:
+            query = query.where(results.c.dt <= upto)
+        [(res,)] = dbh.connection.execute(query)
+        dbh.close()
+        return res
+
+
+ROWID = literal_column('rowid')
+
+
+def _range_cond(after: Optional[Revision], upto: Optional[Revision]) -> str:
+    conds = ['1']
+    if after is not None:
+        conds.append('dt > :after')
+    if upto is not None:
+        conds.append('dt <= :upto')
+    return ' AND '.join(conds)
+
+
+def _ignores_join(dbh: DbHelper, ignore_config: Optional[str]) -> Tuple[str, str]:
+    if ignore_config is None or not dbh.ignores_valid(ignore_config):
+        return '0, NULL', ''
+    return 'ignores.result IS NOT NULL, ignores.reason', 'LEFT JOIN ignores ON ignores.result = results.id'
+
+
+class Row:
+    '''
+    Lazy view of a stored result: uid comes straight from the column, blob is only decoded on demand
+    If cached is set, reason is the stored ignore decision for the row.
+    thash is the stored tracked_hash (not necessarily valid, see DbHelper.hashes_valid)
+    '''
+    __slots__ = ('rowid', 'uid', 'revision', 'blob', 'thash', 'cached', 'reason', 'codec')
+
+    def __init__(self, rowid: int, uid: str, revision: Revision, blob: Blob, thash: Optional[bytes]=None, cached: bool=False, reason: Optional[str]=None, *, codec: Codec) -> None:
+        self.rowid    = rowid
+        self.uid      = uid
+        self.revision = revision
+        self.blob     = blob
+        self.thash    = thash
+        self.cached   = bool(cached)
+        self.reason   = reason
+        self.codec    = codec
+
+    @property
+    def json(self) -> Json:
+        return self.codec.decode(self.blob)
 
 
 class DbWriter:
-    def __init__(self, db_path: Path) -> None:
+    # blob_format is only used when the database is created, after that it's stored in the database
+    # source/schema/queries are (re)recorded in meta on every commit, so readers don't have to guess them from the filename
+    # tracked: fields to compute tracked_hash for. If not passed, the fields stored in meta (if any) are used
+    def __init__(
+            self,
+            db_path: Path,
+            blob_format: Optional[str]=None,
+            *,
+            source: Optional[str]=None,
+            schema: Optional[Sequence[str]]=None,
+            queries: Optional[Sequence[str]]=None,
+            tracked: Optional[Sequence[str]]=None,
+    ) -> None:
         self.db_path = db_path
+        self.blob_format = blob_format
+        self.meta: Dict[str, Any] = {}
+        if source is not None:
+            self.meta['source'] = source
+        if schema is not None:
+            self.meta['schema'] = list(schema)
+        if queries is not None:
+            self.meta['queries'] = list(queries)
+        self.tracked = None if tracked is None else list(tracked)
 
 
     def commit(self, jsons: Jsons, query: str) -> None:
@@ -105,7 +447,25 @@ class DbWriter:
 
     # TODO could return stats?
     def _commit(self, *, sha: str, dt: datetime, jsons: Jsons, query: str) -> None:
-        db = DbHelper(db_path=self.db_path)
+        db = DbHelper(db_path=self.db_path, migrate=True)
+        if self.blob_format is not None and 'blob_format' not in db.get_meta():
+            jsons = list(jsons)
+            if self.blob_format != JSON.name:
+                [(existing,)] = db.connection.execute(func.count(db.results))
+                assert existing == 0, f"{self.db_path} already has json blobs, use 'convert' instead"
+            if len(jsons) > 0:
+                db.set_meta(**blob_meta(self.blob_format, jsons))
+        codec = db.codec
+        # NOTE: if nothing was written yet, the format isn't recorded until there are results (msgpack needs the fields)
+        if self.blob_format is not None and 'blob_format' in db.get_meta() and codec.name != self.blob_format:
+            raise RuntimeError(f"{self.db_path} stores {codec.name} blobs, use 'convert' to switch to {self.blob_format}")
+        stored = db.get_meta().get('source')
+        source = self.meta.get('source')
+        if stored is not None and source is not None and stored != source:
+            raise RuntimeError(f"{self.db_path} stores {stored} results, can't write {source} results into it")
+        stored_tracked = db.get_meta().get('tracked')
+        tracked = stored_tracked if self.tracked is None else self.tracked
+
         pre_batchsize = len(jsons) if isinstance(jsons, list) else -1
         logger.info('processing %s %s (%s results)', sha, dt, pre_batchsize)
 
@@ -117,25 +477,28 @@ class DbWriter:
         duplicates = 0
 
         # meh, but querying a database 10K times can't be fast enough I guess
-        existing_blobs = {
-            row[0] for row in db.connection.execute(select([db.results.c.blob]))
-        }
+        existing_blobs = set()
+        existing_uids = set()
+        for uid, blob in db.connection.execute(select([db.results.c.uid, db.results.c.blob])):
+            existing_uids.add(uid)
+            existing_blobs.add(blob)
+        # uids of inserted rows, which were in the database already, i.e. updates
+        updated_uids = set()
 
         batchsize = 0
         def iter_unique():
             nonlocal batchsize
             for j in jsons:
                 batchsize += 1
-                # ordereddict isn't super necessary on python 3.6+, but just in case..
-                json_sorted = OrderedDict(sorted(j.items()))
                 # TODO hmm. maybe use cachew mappings here?
-                blob = json.dumps(json_sorted)
+                blob = codec.encode(j)
 
                 uid = j['uid']
                 db_dict = {
-                    db.UID : uid,
-                    db.DT  : dtstr,
-                    db.BLOB: blob,
+                    db.UID  : uid,
+                    db.DT   : dtstr,
+                    db.BLOB : blob,
+                    db.THASH: None if not tracked else tracked_hash([j.get(f) for f in tracked]),
                 }
                 # dataset:
                 # - with duplicate detection:
@@ -167,29 +530,25 @@ class DbWriter:
                 if not existing:
                     # eh, don't like this vvvv, but on the other hand that saves us from duplicates in the input data
                     existing_blobs.add(blob)
+                    if uid in existing_uids:
+                        updated_uids.add(uid)
+                    existing_uids.add(uid)
                     yield db_dict
                 else:
                     nonlocal duplicates
                     duplicates += 1
         chunk_size = 1000
-        for chunk in ichunks(iter_unique(), n=chunk_size):
-            db.connection.execute(db.results.insert(), chunk)
-
-        # compute updates; while it's possible to figure out later, nice to have it for logging
-        # ugh. I'm too lazy to figure this out in sqlalchemy...
-        groups = list(db.connection.execute(text('''
-SELECT A.uid, COUNT(*) FROM
-results AS A
-JOIN
-results AS B
-ON  A.dt  = :dtstr
-AND A.uid = B.uid
-GROUP BY A.uid;
-        '''), dtstr=dtstr))
-        updates = 0
-        for (_, gsize) in groups:
-            if gsize > 1:
-                updates += 1
+        # single transaction, so readers never see a partially written revision (e.g. digest cache relies on it)
+        with db.connection.begin():
+            if tracked is not None and tracked != stored_tracked:
+                db.reset_hashes(tracked)
+            for chunk in ichunks(iter_unique(), n=chunk_size):
+                db.connection.execute(db.results.insert(), chunk)
+            if len(self.meta) > 0:
+                db.set_meta(**self.meta)
+
+        # while it's possible to figure out later, nice to have it for logging
+        updates = len(updated_uids)
         [(total,)] = db.connection.execute(func.count(db.results))
 
         logline = f'''
@@ -209,3 +568,95 @@ total     : {total}
 
         logger.info('database %s, size %.2f Mb', self.db_path, self.db_path.stat().st_size / 10 ** 6)
         db.close()
+
+
+# meta keys describing the blob format, see blob_meta
+BLOB_META = ('blob_format', 'fields', 'dates')
+
+def blob_meta(blob_format: str, jsons: Jsons) -> Dict[str, Any]:
+    if blob_format == JSON.name:
+        return {'blob_format': blob_format}
+    assert blob_format == MsgpackCodec.name, blob_format
+    fieldss = {tuple(sorted(j.keys())) for j in jsons}
+    assert len(fieldss) <= 1, fieldss # each database only stores one type of results
+    [fields] = fieldss if len(fieldss) > 0 else [()]
+    return {
+        'blob_format': blob_format,
+        'fields'     : list(fields),
+        # TODO should probably come from JsonTrait?
+        'dates'      : [f for f in fields if f == 'when'],
+    }
+
+
+def convert(src: Path, dst: Path, blob_format: str) -> None:
+    """
+    Copies the database, reencoding all blobs. Blobs stay canonical, so deduplication keeps working
+    Everything else (ids, meta, ignore decisions, logs) is copied as is.
+    """
+    assert not dst.exists(), dst
+    sdb = DbHelper(db_path=src, migrate=True)
+    scodec = sdb.codec
+    def iter_rows():
+        results = sdb.results
+        for id_, uid, dt, blob, thash in sdb.connection.execute(select([results.c.id, results.c.uid, results.c.dt, results.c.blob, results.c.thash]).order_by(results.c.id)):
+            yield id_, uid, dt, jsonable(scodec.decode(blob)), thash
+
+    ddb = DbHelper(db_path=dst, migrate=True)
+    # source/schema/queries/tracked etc. don't depend on the blob format
+    ddb.set_meta(**{k: v for k, v in sdb.get_meta().items() if k not in BLOB_META})
+    # eh. need to know the fields before we start writing
+    ddb.set_meta(**blob_meta(blob_format, (j for _, _, _, j, _ in iter_rows())))
+    dcodec = ddb.codec
+    for chunk in ichunks(iter_rows(), n=1000):
+        ddb.connection.execute(ddb.results.insert(), [{
+            ddb.ID  : id_, # ignore decisions refer to them
+            ddb.UID : uid,
+            ddb.DT  : dt,
+            ddb.BLOB: dcodec.encode(j),
+            ddb.THASH: thash, # hashes don't depend on the blob format
+        } for id_, uid, dt, j, thash in chunk])
+    ignores = list(sdb.connection.execute(select([sdb.ignores.c.result, sdb.ignores.c.reason])))
+    for chunk in ichunks(ignores, n=1000):
+        ddb.connection.execute(ddb.ignores.insert(), [{
+            ddb.RESULT_COL: result,
+            ddb.REASON_COL: reason,
+        } for result, reason in chunk])
+    logs = list(sdb.connection.execute(sdb.logs.select().order_by(text('rowid'))))
+    if len(logs) > 0:
+        ddb.connection.execute(ddb.logs.insert(), [{
+            ddb.DT_COL : dt,
+            ddb.LOG_COL: log,
+        } for dt, log in logs])
+    logger.info('converted %s (%.2f Mb) to %s (%.2f Mb, %s)', src, src.stat().st_size / 10 ** 6, dst, dst.stat().st_size / 10 ** 6, blob_format)
+    sdb.close()
+    ddb.close()
+
+
+def migrate(db: Path) -> None:
+    """
+    Brings an older database up to date, otherwise it only happens on the next crawl
+    """
+    DbHelper(db_path=db, migrate=True).close()
+
+
+def main() -> None:
+    p = argparse.ArgumentParser()
+    sp = p.add_subparsers(dest='mode')
+    cp = sp.add_parser('convert', help='convert blobs to a different format')
+    cp.add_argument('--format', choices=BLOB_FORMATS, required=True)
+    cp.add_argument('src', type=Path)
+    cp.add_argument('dst', type=Path)
+    mp = sp.add_parser('migrate', help='update the schema of older databases')
+    mp.add_argument('dbs', nargs='+', type=Path)
+    args = p.parse_args()
+    if args.mode == 'convert':
+        convert(args.src, args.dst, blob_format=args.format)
+    elif args.mode == 'migrate':
+        for db in args.dbs:
+            migrate(db)
+    else:
+        raise RuntimeError(args.mode)
+
+
+if __name__ == '__main__':
+    main()
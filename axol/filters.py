@@ -0,0 +1,160 @@
+import re
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Pattern, Sequence, Tuple, Union
+
+
+@lru_cache(None)
+def _compile(regex: str, flags: int=0) -> Pattern:
+    return re.compile(regex, flags)
+
+
+class Subreddit(NamedTuple):
+    regex: str
+
+    def matches(self, item) -> bool:
+        return _compile(self.regex, re.I).fullmatch(item.subreddit) is not None
+
+    @property
+    def reason(self) -> str:
+        return f'subreddit {self.regex}'
+
+class Contains(NamedTuple):
+    seq: str
+
+    def matches(self, item) -> bool:
+        return self.seq in contains_text(item)
+
+    @property
+    def reason(self) -> str:
+        return f'contains {self.seq}'
+
+
+def contains_text(item) -> str:
+    return f'{item.title} {item.description} {item.subreddit}'.lower()
+
+
+# filters below look at a single (lowercased) column of an item, so they can be evaluated column-wise over many items
+
+# e.g. twitter search also returns all tweets by users with the query in their username
+class UserContains(NamedTuple):
+    seq: str
+    column: str = 'user'
+
+    def compile(self) -> Callable[[str], bool]:
+        seq = self.seq
+        return lambda v: seq in v
+
+    @property
+    def reason(self) -> str:
+        return f'user contains {self.seq}'
+
+# e.g. only matched because it's mentioning/replying to someone with the query in their username
+class Mentions(NamedTuple):
+    seq: str
+    column: str = 'text'
+
+    def compile(self) -> Callable[[str], bool]:
+        return _compile(fr'@[0-9a-z_]*{re.escape(self.seq)}').search # type: ignore[return-value]
+
+    @property
+    def reason(self) -> str:
+        return f'mentions {self.seq}'
+
+# e.g. twitter search is fuzzy, so 'memex' might match 'mem_ex'
+class Lacks(NamedTuple):
+    seq: str
+    column: str = 'text'
+
+    def compile(self) -> Callable[[str], bool]:
+        seq = self.seq
+        return lambda v: seq not in v
+
+    @property
+    def reason(self) -> str:
+        return f'lacks {self.seq}'
+
+
+ColumnFilter = Union[UserContains, Mentions, Lacks]
+Filter = Union[Subreddit, Contains, ColumnFilter]
+
+# NOTE: namedtuples of different types compare equal if the values are the same, so need the type as well
+def _dedup(filters: Sequence[Filter]) -> List[Filter]:
+    # preserving the order
+    return [f for _, f in dict.fromkeys((type(f), f) for f in filters)]
+
+
+
+def query_filters(query: str) -> List[Filter]:
+    """
+    Postfiltering for searches that also match usernames (twitter, HN)
+    See https://twittercommunity.com/t/exclude-username-when-searching/10653/3
+    """
+    sq = query.strip("'").strip('""').lower()
+    # TODO cli interface should be exact by default? not sure
+    if ' ' in sq: # hacky way to check that it's single worded?
+        return []
+    return [UserContains(sq), Mentions(sq), Lacks(sq)]
+
+
+class Pipeline:
+    """
+    Column filters compiled once; the first matching filter gives the reason.
+    reasons() evaluates one filter at a time over all items that are still undecided, so each column is only lowercased once.
+    """
+    def __init__(self, filters: Sequence[ColumnFilter]) -> None:
+        self.filters = _dedup(filters)
+        self._tests = [(f.column, f.compile(), f.reason) for f in self.filters]
+
+    def reason(self, item) -> Optional[str]:
+        for column, test, reason in self._tests:
+            if test(str(getattr(item, column)).lower()):
+                return reason
+        return None
+
+    # get: can be operator.getitem to run over jsons, so items don't even need to be decoded
+    def reasons(self, items: Sequence[Any], get: Callable[[Any, str], Any]=getattr) -> List[Optional[str]]:
+        res: List[Optional[str]] = [None] * len(items)
+        columns: Dict[str, List[str]] = {}
+        todo = range(len(items))
+        for column, test, reason in self._tests:
+            if column not in columns:
+                columns[column] = [str(get(i, column)).lower() for i in items]
+            values = columns[column]
+            rest = []
+            for idx in todo:
+                if test(values[idx]):
+                    res[idx] = reason
+                else:
+                    rest.append(idx)
+            todo = rest
+        return res
+
+
+class Excluder:
+    """
+    Filters compiled into a combined regex per filter kind, so items that don't match anything (vast majority)
+    are rejected with at most two regex calls. On a hit, filters are checked one by one to get the first matching reason.
+    """
+    def __init__(self, filters: Sequence[Filter]) -> None:
+        self.filters = _dedup(filters)
+        subs = [f.regex for f in self.filters if isinstance(f, Subreddit)]
+        seqs = [f.seq   for f in self.filters if isinstance(f, Contains)]
+        for f in self.filters:
+            assert isinstance(f, (Subreddit, Contains)), f
+        # NOTE: fullmatch applies to the whole alternation, so it matches iff one of the alternatives fully matches
+        self._subs  = None if len(subs) == 0 else re.compile('|'.join(f'(?:{s})' for s in subs), re.I)
+        # NOTE: longest first, doesn't matter for the result but makes the alternation fail faster
+        self._seqs  = None if len(seqs) == 0 else re.compile('|'.join(re.escape(s) for s in sorted(seqs, key=len, reverse=True)))
+
+    def reason(self, item) -> Optional[str]:
+        hit = False
+        if self._subs is not None and self._subs.fullmatch(item.subreddit) is not None:
+            hit = True
+        elif self._seqs is not None and self._seqs.search(contains_text(item)) is not None:
+            hit = True
+        if not hit:
+            return None
+        for f in self.filters:
+            if f.matches(item):
+                return f.reason
+        raise AssertionError(f'combined filters matched {item}, but none of the individual ones did')
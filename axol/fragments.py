@@ -0,0 +1,117 @@
+import hashlib
+import sqlite3
+import time
+from pathlib import Path
+from typing import Any, Callable, Optional, Sequence, Tuple
+
+from .common import logger
+from .core.kdominate import prerendered
+
+import dominate
+
+
+# rendering depends on the indentation level the fragment ends up at, so it's a part of the key
+# (level, indent, pretty, xhtml)
+RenderArgs = Tuple[int, str, bool, bool]
+
+
+def group_key(objs: Sequence[Tuple[Any, Any]]) -> str:
+    # NOTE: results are namedtuples of primitive types/datetimes, so repr is stable and determined by the contents
+    return hashlib.blake2b(repr(list(objs)).encode('utf8'), digest_size=16).hexdigest()
+
+
+class FragmentCache:
+    '''
+    Rendered HTML of formatted item groups, keyed by the group contents.
+    Fragments are written through to an sqlite database, so they aren't kept in memory.
+    Only the fragments used during the run are kept on save, so the cache doesn't grow unboundedly.
+    '''
+    def __init__(self, path: Optional[Path], version: str) -> None:
+        self.path = path
+        self.version = f'{version}:{dominate.__version__}'
+        self.conn = self._connect()
+        self.hits   = 0
+        self.misses = 0
+        self.saved  = 0.0
+        self.spent  = 0.0
+
+    def _open(self) -> sqlite3.Connection:
+        if self.path is None:
+            # empty name means a temporary on-disk database, removed on close
+            return sqlite3.connect('')
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        return sqlite3.connect(str(self.path))
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = self._open()
+        try:
+            conn.execute('CREATE TABLE IF NOT EXISTS meta (version TEXT)')
+        except sqlite3.DatabaseError as e:
+            # e.g. pickle from the older versions
+            logger.warning('error while loading fragment cache %s, ignoring', self.path)
+            logger.exception(e)
+            conn.close()
+            assert self.path is not None
+            self.path.unlink()
+            conn = self._open()
+            conn.execute('CREATE TABLE meta (version TEXT)')
+        conn.execute('CREATE TABLE IF NOT EXISTS fragments (key TEXT, args TEXT, html TEXT, cost REAL, run INTEGER, PRIMARY KEY (key, args))')
+        with conn:
+            stored = conn.execute('SELECT version FROM meta').fetchone()
+            if stored is None or stored[0] != self.version:
+                if stored is not None:
+                    logger.info('fragment cache %s is stale, ignoring', self.path)
+                conn.execute('DELETE FROM fragments')
+                conn.execute('DELETE FROM meta')
+                conn.execute('INSERT INTO meta VALUES (?)', (self.version,))
+            [(last,)] = conn.execute('SELECT MAX(run) FROM fragments')
+        # fragments used during this run are marked with it, the rest are dropped on save
+        self.run = 0 if last is None else last + 1
+        return conn
+
+    def save(self) -> None:
+        if self.path is None:
+            return
+        with self.conn:
+            self.conn.execute('DELETE FROM fragments WHERE run != ?', (self.run,))
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def __enter__(self) -> 'FragmentCache':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def render(self, key: str, make: Callable[[], Any], args: RenderArgs=(0, '  ', True, False)) -> str:
+        rargs = repr(args)
+        res = self.conn.execute('SELECT html, cost FROM fragments WHERE key = ? AND args = ?', (key, rargs)).fetchone()
+        if res is not None:
+            html, cost = res
+            self.hits += 1
+            self.saved += cost
+            self.conn.execute('UPDATE fragments SET run = ? WHERE key = ? AND args = ?', (self.run, key, rargs))
+        else:
+            self.misses += 1
+            start = time.perf_counter()
+            made = make()
+            if isinstance(made, dominate.dom_tag.dom_tag): # type: ignore
+                html = ''.join(made._render([], *args))
+            else:
+                html = str(made)
+            cost = time.perf_counter() - start
+            self.spent += cost
+            self.conn.execute('INSERT INTO fragments VALUES (?, ?, ?, ?, ?)', (key, rargs, html, cost, self.run))
+        return html
+
+    def tag(self, key: str, make: Callable[[], Any]):
+        '''
+        Placeholder tag, rendered (or taken from the cache) when the document is rendered
+        '''
+        return prerendered(render=lambda *args: self.render(key, make, args))
+
+    def stats(self) -> str:
+        total = self.hits + self.misses
+        rate = 0 if total == 0 else self.hits / total * 100
+        return f'fragments: {self.hits}/{total} cached ({rate:.0f}%), {self.spent:.2f}s rendering, ~{self.saved:.2f}s saved'
@@ -1,7 +1,8 @@
 # knows how to jsonify each specific query?
 # this is a bit nicer -- kinda like mixins but dynamic.. so the code doesn't have to interleave with fetchers
 from datetime import datetime
-from typing import Type
+from functools import lru_cache
+from typing import Any, Callable, Sequence, Type
 
 from .core.common import classproperty, Json
 from .core.kjson import ToFromJson
@@ -11,17 +12,26 @@ from .trait import AbsTrait, pull
 
 # TODO rename Target to Self?
 class JsonTrait(AbsTrait): # TODO generic..
+    # repetitive fields, shared between items on decoding to save memory
+    interned: Sequence[str] = ()
+
     @classproperty
     def tofrom(trait):
-        return ToFromJson( # TODO FIXME isoformat??
-            trait.Target,
-            as_dates=['when'],
-        )
+        # cached, since it's on the hot path
+        return _tofrom(trait)
 
     @classmethod
     def from_json(trait, obj: Json):
         return trait.tofrom.from_(obj)
 
+    @classmethod
+    def decoder(trait) -> Callable[[Json], Any]:
+        """
+        from_json which also interns the repetitive fields.
+        The interner keeps every distinct value it has seen, so should be created per decoding pass rather than shared by the whole process
+        """
+        return ToFromJson(trait.Target, as_dates=['when'], interned=trait.interned).from_
+
     @classmethod
     def to_json(trait, item):
         res = trait.tofrom.to(item)
@@ -31,19 +41,28 @@ class JsonTrait(AbsTrait): # TODO generic..
 to_json = pull(JsonTrait.to_json)
 
 
+# NOTE: no interning here, otherwise it would accumulate values from everything the process ever decoded
+@lru_cache(None)
+def _tofrom(trait) -> ToFromJson:
+    return ToFromJson( # TODO FIXME isoformat??
+        trait.Target,
+        as_dates=['when'],
+    )
+
+
 class SpinboardJsonTrait(ForSpinboard, JsonTrait):
-    pass
+    interned = ('user', 'tags')
 
 class ReachJsonTrait(ForReach, JsonTrait):
-    pass
+    interned = ('user', 'subreddit')
 
 class TentacleJsonTrait(ForTentacle, JsonTrait):
-    pass
+    interned = ('user',)
 
 class TwitterJsonTrait(ForTwitter, JsonTrait):
-    pass
+    interned = ('user',)
 
 class HackernewsJsonTrait(ForHackernews, JsonTrait):
-    pass
+    interned = ('user',)
 
 JsonTrait.reg(SpinboardJsonTrait, ReachJsonTrait, TentacleJsonTrait, TwitterJsonTrait, HackernewsJsonTrait)
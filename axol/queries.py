@@ -1,6 +1,7 @@
 from typing import Sequence
 
 from .common import Query, slugify, Filter
+from .filters import query_filters
 # TODO Filter needs to be a more flexible type...
 
 from more_itertools import flatten
@@ -90,9 +91,10 @@ class TwitterQ(Query):
     def sname(self):
         return 'twitter'
 
-    def __init__(self, qname: str, query: str): # TODO FIXME multiple
+    def __init__(self, qname: str, query: str, excluded: Sequence[Filter]=()): # TODO FIXME multiple
         self.qname = qname
         self.queries = list(map(pinboard_quote, [query]))
+        self.excluded = [*query_filters(self.queries[0]), *flatten(excluded)]
 
     @property
     def repo_name(self) -> str:
@@ -130,9 +132,10 @@ class PinboardQ(Query):
         return str(self.__dict__)
 
 class BaseQuery(Query):
-    def __init__(self, qname: str, query: str): # TODO FIXME multiple
+    def __init__(self, qname: str, query: str, excluded: Sequence[Filter]=()): # TODO FIXME multiple
         self.qname = qname
         self.queries = list(map(pinboard_quote, [query]))
+        self.excluded = list(flatten(excluded))
 
     @property
     def repo_name(self) -> str:
@@ -1,26 +1,34 @@
 #!/usr/bin/env python3
 import argparse
+import hashlib
+import json
+import pickle
 import re
 import sys
+import threading
+import time
 import logging
+import os
 import warnings
 from collections import Counter
-from concurrent.futures import ProcessPoolExecutor
-from datetime import datetime, timezone
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime, timedelta, timezone
 from itertools import islice, chain
 from pathlib import Path
 from pprint import pprint
 from subprocess import check_call, check_output
-from typing import (Any, Dict, Iterator, List, NamedTuple, Optional, Sequence,
-                    Tuple, Type, Union, Mapping)
+from typing import (Any, Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence,
+                    Set, Tuple, Type, Union, Mapping)
 
-from .core.common import classproperty, the
-from .core.kdominate import adhoc_html
+from .core.common import classproperty, the, Json
+from .core.kdominate import stream_document, prerendered, Template, nl
+from .fragments import FragmentCache, group_key
 
 from .common import logger
-from .storage import Changes, get_digest, get_result_type
+from .storage import Changes, get_digest, get_result_type, digest_version
+from .database import DbReader
 from .trait import AbsTrait, pull
-from .traits import ForReach, ForSpinboard, ForTentacle, ForTwitter, ForHackernews, IgnoreTrait, ignore_result, For
+from .traits import ForReach, ForSpinboard, ForTentacle, ForTwitter, ForHackernews, IgnoreTrait, ignore_result, For, for_repo, for_source
 
 import dominate
 import dominate.tags as T
@@ -29,8 +37,7 @@ from more_itertools import flatten
 
 from config import DATABASES
 
-from functools import cached_property
-cproperty = cached_property # meh, some legacy uses
+from functools import partial
 
 
 
@@ -111,23 +118,16 @@ class SpinboardFormat(ForSpinboard, FormatTrait):
         link = trait.link(objs)
         res.add(T.div(T.a(title, href=link)))
 
-        with adhoc_html('pinboard', cb=lambda children: res.add(*children)):
-            with T.table():
-                for _, obj in objs:
-                    if not isempty(obj.description):
-                        with T.tr():
-                            with T.td(colspan=3):
-                                T.span(obj.description, cls='description')
-                    with T.tr():
-                        # TODO wtf is min??
-                        with T.td(cls='min'):
-                            T.a(f'{fdate(obj.when)}', href=obj.blink, cls='permalink timestamp')
-                        with T.td(cls='min'):
-                            text('by ')
-                            trait.user_link(user=obj.user)
-                        with T.td():
-                            for t in obj.ntags:
-                                trait.tag_link(tag=t, user=obj.user)
+        table = res.add(T.table())
+        for _, obj in objs:
+            if not isempty(obj.description):
+                table.add(T.tr(T.td(T.span(obj.description, cls='description'), colspan=3)))
+            table.add(T.tr(
+                # TODO wtf is min??
+                T.td(T.a(f'{fdate(obj.when)}', href=obj.blink, cls='permalink timestamp'), cls='min'),
+                T.td(text('by '), trait.user_link(user=obj.user), cls='min'),
+                T.td(*(trait.tag_link(tag=t, user=obj.user) for t in obj.ntags)),
+            ))
         # TODO userstats
         return res
 
@@ -156,17 +156,17 @@ class ReachFormat(ForReach, FormatTrait):
         ll = reddit(link)
 
         res.add(T.div(T.a(title, href=ll)))
-        with adhoc_html('reddit', cb=lambda ch: res.add(*ch)):
-            for _, obj in objs:
-                if not isempty(obj.description):
-                    T.div(obj.description)
-                T.div(trait.subreddit_link(obj.subreddit))
-                with T.div():
-                    ud = f'{obj.ups}⇅{obj.downs}' # TODO sum all ups and downs??
-                    T.b(ud)
-                    T.a(f'{obj.when.strftime("%Y-%m-%d %H:%M")}', href=ll, cls='permalink')
-                    text(' by ')
-                    trait.user_link(user=obj.user)
+        for _, obj in objs:
+            if not isempty(obj.description):
+                res.add(T.div(obj.description))
+            res.add(T.div(trait.subreddit_link(obj.subreddit)))
+            ud = f'{obj.ups}⇅{obj.downs}' # TODO sum all ups and downs??
+            res.add(T.div(
+                T.b(ud),
+                T.a(f'{obj.when.strftime("%Y-%m-%d %H:%M")}', href=ll, cls='permalink'),
+                text(' by '),
+                trait.user_link(user=obj.user),
+            ))
         return res
 
 class TentacleTrait(ForTentacle, FormatTrait):
@@ -181,15 +181,14 @@ class TentacleTrait(ForTentacle, FormatTrait):
         res = T.div(cls='github')
         res.add(T.div(T.a(trait.title(objs), href=trait.link(objs))))
         # TODO total stars?
-        with adhoc_html('github', cb=lambda ch: res.add(*ch)):
-            for _, obj in objs:
-                if not isempty(obj.description):
-                    T.div(obj.description)
-                with T.div():
-                    if obj.stars > 0:
-                        sts = '' if obj.stars == 1 else str(obj.stars)
-                        T.b(sts + '★')
-                    T.a(f'{obj.when.strftime("%Y-%m-%d %H:%M")} by {obj.user}', href=obj.link, cls='permalink')
+        for _, obj in objs:
+            if not isempty(obj.description):
+                res.add(T.div(obj.description))
+            dd = res.add(T.div())
+            if obj.stars > 0:
+                sts = '' if obj.stars == 1 else str(obj.stars)
+                dd.add(T.b(sts + '★'))
+            dd.add(T.a(f'{obj.when.strftime("%Y-%m-%d %H:%M")} by {obj.user}', href=obj.link, cls='permalink'))
         return res
         # TODO indicate how often is user showing up?
 
@@ -210,19 +209,18 @@ class FormatTwitter(ForTwitter, FormatTrait):
     def format(trait, objs) -> Htmlish:
         res = T.div(cls='twitter')
         # res.add(T.div(T.a(trait.title(objs), href=tw(trait.link(objs)))))
-        with adhoc_html('twitter', cb=lambda ch: res.add(*ch)):
-            for _, obj in objs:
-                T.div(obj.text)
-                with T.div():
-                    if obj.likes + obj.retweets + obj.replies > 0:
-                        ll = f'★{obj.likes} ♺{obj.retweets} 🗬{obj.replies}'
-                        T.b(ll)
-                    T.a(
-                        f'{obj.when.strftime("%Y-%m-%d %H:%M")} by {obj.user}',
-                        href=tw(obj.link),
-                        cls='permalink',
-                    )
-                    T.a('X', user=obj.user, cls='blacklist')
+        for _, obj in objs:
+            res.add(T.div(obj.text))
+            dd = res.add(T.div())
+            if obj.likes + obj.retweets + obj.replies > 0:
+                ll = f'★{obj.likes} ♺{obj.retweets} 🗬{obj.replies}'
+                dd.add(T.b(ll))
+            dd.add(T.a(
+                f'{obj.when.strftime("%Y-%m-%d %H:%M")} by {obj.user}',
+                href=tw(obj.link),
+                cls='permalink',
+            ))
+            dd.add(T.a('X', user=obj.user, cls='blacklist'))
         return res
 
 def hn(s):
@@ -236,43 +234,267 @@ class FormatHackernews(ForHackernews, FormatTrait):
     @classmethod
     def format(trait, objs) -> Htmlish:
         res = T.div(cls='hackernews')
-        with adhoc_html('hackernews', cb=lambda ch: res.add(*ch)):
-            for _, obj in objs:
-                if obj.url is not None:
-                    T.div(T.a(obj.title, href=obj.url))
-                T.div(raw(obj.text), cls='text') # eh, it's html
-                with T.div():
-                    extra = []
-                    if obj.points > 0:
-                        extra.append(f'🠅{obj.points}')
-                    if obj.comments > 0:
-                        extra.append(f'🗬{obj.comments}')
-                    T.b(' '.join(extra))
-                    T.a(
-                        obj.when.strftime('%Y-%m-%d %H:%M'),
-                        href=obj.link,
-                        cls='permalink', # TODO FIXME not sure if should use 'timestamp' class??
-                    )
-                    text(' by ')
-                    trait.user_link(user=obj.user)
+        for _, obj in objs:
+            if obj.url is not None:
+                res.add(T.div(T.a(obj.title, href=obj.url)))
+            res.add(T.div(raw(obj.text), cls='text')) # eh, it's html
+            extra = []
+            if obj.points > 0:
+                extra.append(f'🠅{obj.points}')
+            if obj.comments > 0:
+                extra.append(f'🗬{obj.comments}')
+            res.add(T.div(
+                T.b(' '.join(extra)),
+                T.a(
+                    obj.when.strftime('%Y-%m-%d %H:%M'),
+                    href=obj.link,
+                    cls='permalink', # TODO FIXME not sure if should use 'timestamp' class??
+                ),
+                text(' by '),
+                trait.user_link(user=obj.user),
+            ))
         return res
 
 
 FormatTrait.reg(ReachFormat, SpinboardFormat, TentacleTrait, FormatTwitter, FormatHackernews)
 
 
-# TODO hmm. instead percentile would be more accurate?...
-def get_user_stats(jsons, rtype=None):
-    cc = Collector()
-    for jj in jsons:
-        rev, dd, j = jj
-        items = list(map(lambda x: from_json(rtype, x), j))
-        cc.register(items)
-    cnt = Counter([i.user for i in cc.items.values()])
-    total = max(sum(cnt.values()), 1)
-    return {
-        u: v / total for u, v in cnt.items()
-    }
+# Same html as the formatters above, but rendered from precompiled string templates (a lot faster than building dominate trees).
+# Templates are written the way dominate pretty prints the elements, so both backends give identical output; see test_template_formatters
+FORMATTERS = ('dom', 'template')
+
+
+class TemplateFormat:
+    @classmethod
+    def format(trait, objs, *args, **kwargs) -> Htmlish:
+        def render(level: int, indent: str, pretty: bool, xhtml: bool) -> str:
+            assert pretty and not xhtml # templates only support the default rendering
+            return trait.html(objs, level, indent)
+        return prerendered(render=render)
+
+    @classmethod
+    def html(trait, objs, level: int, indent: str) -> str:
+        raise NotImplementedError
+
+
+def children(snippets: Iterable[str], level: int, indent: str) -> str:
+    return ''.join(nl(level, indent) + s for s in snippets)
+
+
+PINBOARD = Template(
+    '<div class="pinboard">\n'
+    '  <div>\n'
+    '    <a href="{link}">{title}</a>\n'
+    '  </div>\n'
+    '  <table>{rows}\n'
+    '  </table>\n'
+    '</div>'
+, raw=['rows'])
+PINBOARD_DESCRIPTION = Template(
+    '<tr>\n'
+    '  <td colspan="3">\n'
+    '    <span class="description">{description}</span>\n'
+    '  </td>\n'
+    '</tr>'
+)
+PINBOARD_ROW = Template(
+    '<tr>\n'
+    '  <td class="min">\n'
+    '    <a class="permalink timestamp" href="{blink}">{when}</a>\n'
+    '  </td>\n'
+    '  <td class="min">by \n'
+    '    <a class="user" href="{user_link}">{user}</a>\n'
+    '  </td>\n'
+    '  <td>{tags}</td>\n'
+    '</tr>'
+, raw=['tags'])
+PINBOARD_TAG = Template('<a class="tag" href="{link}">#{tag}</a>')
+
+class SpinboardTemplate(TemplateFormat, SpinboardFormat):
+    @classmethod
+    def html(trait, objs, level: int, indent: str) -> str:
+        rl = level + 2
+        rows = []
+        for _, obj in objs:
+            if not isempty(obj.description):
+                rows.append(PINBOARD_DESCRIPTION.render(rl, indent, description=obj.description))
+            tags = children((PINBOARD_TAG.render(rl + 2, indent, link=trait.plink(tag=t, user=obj.user), tag=t) for t in obj.ntags), rl + 2, indent)
+            if len(tags) > 0:
+                tags += nl(rl + 1, indent)
+            rows.append(PINBOARD_ROW.render(
+                rl, indent,
+                blink=obj.blink,
+                when=fdate(obj.when),
+                user_link=trait.plink(user=obj.user),
+                user=obj.user,
+                tags=tags,
+            ))
+        return PINBOARD.render(level, indent, link=trait.link(objs), title=trait.title(objs), rows=children(rows, rl, indent))
+
+
+REDDIT = Template(
+    '<div class="reddit">\n'
+    '  <div>\n'
+    '    <a href="{link}">{title}</a>\n'
+    '  </div>{body}\n'
+    '</div>'
+, raw=['body'])
+REDDIT_DESCRIPTION = Template('<div>{description}</div>')
+REDDIT_SUBREDDIT = Template(
+    '<div>\n'
+    '  <a class="subreddit" href="{link}">{subreddit}</a>\n'
+    '</div>'
+)
+REDDIT_ITEM = Template(
+    '<div>\n'
+    '  <b>{ud}</b>\n'
+    '  <a class="permalink" href="{link}">{when}</a> by \n'
+    '  <a class="user" href="{user_link}">{user}</a>\n'
+    '</div>'
+)
+
+class ReachTemplate(TemplateFormat, ReachFormat):
+    @classmethod
+    def html(trait, objs, level: int, indent: str) -> str:
+        il = level + 1
+        ll = reddit(trait.link(objs))
+        body = []
+        for _, obj in objs:
+            if not isempty(obj.description):
+                body.append(REDDIT_DESCRIPTION.render(il, indent, description=obj.description))
+            body.append(REDDIT_SUBREDDIT.render(il, indent, link=reddit('/r/' + obj.subreddit), subreddit=obj.subreddit))
+            body.append(REDDIT_ITEM.render(
+                il, indent,
+                ud=f'{obj.ups}⇅{obj.downs}',
+                link=ll,
+                when=obj.when.strftime("%Y-%m-%d %H:%M"),
+                user_link=reddit('/u/' + obj.user),
+                user=obj.user,
+            ))
+        return REDDIT.render(level, indent, link=ll, title=trait.title(objs), body=children(body, il, indent))
+
+
+GITHUB = Template(
+    '<div class="github">\n'
+    '  <div>\n'
+    '    <a href="{link}">{title}</a>\n'
+    '  </div>{body}\n'
+    '</div>'
+, raw=['body'])
+GITHUB_DESCRIPTION = Template('<div>{description}</div>')
+GITHUB_ITEM = Template(
+    '<div>{stars}\n'
+    '  <a class="permalink" href="{link}">{permalink}</a>\n'
+    '</div>'
+, raw=['stars'])
+GITHUB_STARS = Template('<b>{stars}★</b>')
+
+class TentacleTemplate(TemplateFormat, TentacleTrait):
+    @classmethod
+    def html(trait, objs, level: int, indent: str) -> str:
+        il = level + 1
+        body = []
+        for _, obj in objs:
+            if not isempty(obj.description):
+                body.append(GITHUB_DESCRIPTION.render(il, indent, description=obj.description))
+            stars = ''
+            if obj.stars > 0:
+                stars = nl(il + 1, indent) + GITHUB_STARS.render(il + 1, indent, stars='' if obj.stars == 1 else obj.stars)
+            body.append(GITHUB_ITEM.render(
+                il, indent,
+                stars=stars,
+                link=obj.link,
+                permalink=f'{obj.when.strftime("%Y-%m-%d %H:%M")} by {obj.user}',
+            ))
+        return GITHUB.render(level, indent, link=trait.link(objs), title=trait.title(objs), body=children(body, il, indent))
+
+
+TWITTER = Template(
+    '<div class="twitter">{body}\n'
+    '</div>'
+, raw=['body'])
+TWITTER_TEXT = Template('<div>{text}</div>')
+TWITTER_ITEM = Template(
+    '<div>{counts}\n'
+    '  <a class="permalink" href="{link}">{permalink}</a>\n'
+    '  <a class="blacklist" user="{user}">X</a>\n'
+    '</div>'
+, raw=['counts'])
+TWITTER_COUNTS = Template('<b>★{likes} ♺{retweets} 🗬{replies}</b>')
+
+class TwitterTemplate(TemplateFormat, FormatTwitter):
+    @classmethod
+    def html(trait, objs, level: int, indent: str) -> str:
+        il = level + 1
+        body = []
+        for _, obj in objs:
+            body.append(TWITTER_TEXT.render(il, indent, text=obj.text))
+            counts = ''
+            if obj.likes + obj.retweets + obj.replies > 0:
+                counts = nl(il + 1, indent) + TWITTER_COUNTS.render(il + 1, indent, likes=obj.likes, retweets=obj.retweets, replies=obj.replies)
+            body.append(TWITTER_ITEM.render(
+                il, indent,
+                counts=counts,
+                link=tw(obj.link),
+                permalink=f'{obj.when.strftime("%Y-%m-%d %H:%M")} by {obj.user}',
+                user=obj.user,
+            ))
+        return TWITTER.render(level, indent, body=children(body, il, indent))
+
+
+HACKERNEWS = Template(
+    '<div class="hackernews">{body}\n'
+    '</div>'
+, raw=['body'])
+HACKERNEWS_TITLE = Template(
+    '<div>\n'
+    '  <a href="{url}">{title}</a>\n'
+    '</div>'
+)
+HACKERNEWS_TEXT = Template('<div class="text">{text}</div>', raw=['text']) # eh, it's html
+HACKERNEWS_ITEM = Template(
+    '<div>\n'
+    '  <b>{extra}</b>\n'
+    '  <a class="permalink" href="{link}">{when}</a> by \n'
+    '  <a class="user" href="{user_link}">{user}</a>\n'
+    '</div>'
+)
+
+class HackernewsTemplate(TemplateFormat, FormatHackernews):
+    @classmethod
+    def html(trait, objs, level: int, indent: str) -> str:
+        il = level + 1
+        body = []
+        for _, obj in objs:
+            if obj.url is not None:
+                body.append(HACKERNEWS_TITLE.render(il, indent, url=obj.url, title=obj.title))
+            body.append(HACKERNEWS_TEXT.render(il, indent, text=obj.text))
+            extra = []
+            if obj.points > 0:
+                extra.append(f'🠅{obj.points}')
+            if obj.comments > 0:
+                extra.append(f'🗬{obj.comments}')
+            body.append(HACKERNEWS_ITEM.render(
+                il, indent,
+                extra=' '.join(extra),
+                link=obj.link,
+                when=obj.when.strftime('%Y-%m-%d %H:%M'),
+                user_link=hn(f'/user?id={obj.user}'),
+                user=obj.user,
+            ))
+        return HACKERNEWS.render(level, indent, body=children(body, il, indent))
+
+
+TEMPLATE_FORMATS = [SpinboardTemplate, ReachTemplate, TentacleTemplate, TwitterTemplate, HackernewsTemplate]
+
+
+def get_format(rtype, formatter: str='dom') -> Type[FormatTrait]:
+    Format = FormatTrait.for_(rtype)
+    if formatter == 'dom':
+        return Format
+    assert formatter == 'template', formatter
+    return the(F for F in TEMPLATE_FORMATS if issubclass(F, Format))
+
 
 # TODO search is a bit of flaky: initially I was getting
 # so like exact opposites
@@ -334,28 +556,12 @@ from .core.common import group_by_key
 # maybe promnesia could also return if it recognized the URL 'completely' or just guessed
 from .core.kurl import normalise
 
-from functools import lru_cache
 from collections import Counter
 
 def vote(l):
     data = Counter(l)
     return data.most_common()[0][0]
 
-# TODO kython??
-# TODO tests next to function kinda like rust
-def invkey(kk):
-    from functools import cmp_to_key
-    def icmp(a, b):
-        ka = kk(a)
-        kb = kk(b)
-        if ka < kb:
-            return 1
-        elif ka > kb:
-            return 1
-        else:
-            return 0
-    return cmp_to_key(icmp)
-
 
 # todo jeez.. why did that happen??
 
@@ -367,35 +573,97 @@ def when_key_tz_hack(x):
     return when
 
 
-class CumulativeBase(AbsTrait):
-    def __init__(self, items: List) -> None:
-        self.items = items
+class Summary(NamedTuple):
+    items: List[Any]
+    link: str
+    title: Optional[str]
+    description: Optional[str]
+    when: datetime
+    users: List[str]
+    tags: List[str]
+    score: int # stars/interactions, whatever the source uses for ranking
 
+
+class CumulativeBase(AbsTrait):
     @classproperty
     def FTrait(cls):
         return FormatTrait.for_(cls.Target)
 
-    @cproperty
-    def nlink(self) -> str:
-        return normalise(self.items[0].link) # TODO not sure if useful..
+    @classproperty
+    def cumkey(cls):
+        # by default, each item is on its own
+        return lambda x: id(x)
 
-    @property # type: ignore
-    @lru_cache()
-    def link(self) -> str:
-        return vote(i.link for i in self.items)
+    @classmethod
+    def item_when(cls, x) -> datetime:
+        return x.when
 
-    @property # type: ignore
-    @lru_cache()
-    def when(self) -> str:
-        return min(x.when for x in self.items)
+    @classmethod
+    def item_score(cls, x) -> int:
+        return 0
 
-    @classproperty
-    def cumkey(cls):
-        raise NotImplementedError
+    @classmethod
+    def item_tags(cls, x) -> List[str]:
+        return []
 
-    @classproperty
-    def sortkey(cls):
-        raise NotImplementedError
+    @classmethod
+    def summarise(cls, items: Iterable[Any]) -> List[Summary]:
+        '''
+        Groups the items by cumkey and computes the aggregates, sorted so the best ones go first
+        '''
+        key, when_of, score_of = cls.cumkey, cls.item_when, cls.item_score
+        # [min when, max score, *items], updated as we go
+        groups: Dict[Any, List[Any]] = {}
+        for x in items:
+            k = key(x)
+            when  = when_of(x)
+            score = score_of(x)
+            g = groups.get(k)
+            if g is None:
+                groups[k] = [when, score, x]
+            else:
+                if when < g[0]:
+                    g[0] = when
+                if score > g[1]:
+                    g[1] = score
+                g.append(x)
+        summaries = [cls._summary(g[2:], when=g[0], score=g[1]) for g in groups.values()]
+        summaries.sort(key=cls.sortkey, reverse=True)
+        return summaries
+
+    @classmethod
+    def _summary(cls, items: List[Any], when: datetime, score: int) -> Summary:
+        if len(items) == 1: # vast majority, no need to vote
+            [x] = items
+            return Summary(
+                items=items,
+                link=x.link,
+                title=getattr(x, 'title', None),
+                description=getattr(x, 'description', None),
+                when=when,
+                users=[x.user],
+                tags=sorted(set(cls.item_tags(x))),
+                score=score,
+            )
+        return Summary(
+            items=items,
+            link=vote(x.link for x in items),
+            title=vote(getattr(x, 'title', None) for x in items),
+            description=vote(getattr(x, 'description', None) for x in items),
+            when=when,
+            users=sorted({x.user for x in items}),
+            tags=sorted({t for x in items for t in cls.item_tags(x)}),
+            score=score,
+        )
+
+    @classmethod
+    def sortkey(cls, s: Summary):
+        # NOTE: used with reverse=True, i.e. highest score first, then most recent first
+        return (s.score, s.when)
+
+    @classmethod
+    def format(cls, s: Summary):
+        return cls.FTrait.format_one(the(s.items))
 
     @classmethod
     def sources_summary(cls, items):
@@ -418,51 +686,26 @@ class SpinboardCumulative(ForSpinboard, CumulativeBase):
         # TODO FIXME reuse grouping code? it could also normalise..
         return lambda x: normalise(x.link)
 
-    @classproperty
-    def sortkey(cls):
-        return invkey(lambda c: c.when)
-
-    # TODO shit, each of them is gonna require something individual??
-    @property # type: ignore
-    @lru_cache()
-    def tags(self) -> List[str]:
-        tt = {x for x in sum((i.ntags for i in self.items), [])}
-        return list(sorted(tt))
-
-    @property # type: ignore
-    @lru_cache()
-    def description(self) -> str:
-        return vote(i.description for i in self.items)
-
-    @property # type: ignore
-    @lru_cache()
-    def title(self) -> str:
-        return vote(i.title for i in self.items)
-
-    @property # type: ignore
-    @lru_cache()
-    def users(self) -> List[str]:
-        uu = {x.user for x in self.items}
-        return list(sorted(uu))
-
-    def format(self):
+    @classmethod
+    def item_tags(cls, x) -> List[str]:
+        return x.ntags
+
+    @classmethod
+    def format(cls, s: Summary):
         # TODO errr.. why is this duplicated??
         # TODO also display total count??
-        # TODO accumulated tags?
-        # return self.FTrait.format_one(self.items[0])
-
         res = T.div(cls='pinboard')
-        res.add(T.a(self.title, href=self.link))
+        res.add(T.a(s.title, href=s.link))
         res.add(T.br())
-        if not isempty(self.description):
-            res.add(self.description)
+        if not isempty(s.description):
+            res.add(s.description)
             res.add(T.br())
         res.add('tags: ')
-        for t in self.tags:
-            res.add(self.FTrait.tag_link(tag=t))
+        for t in s.tags:
+            res.add(cls.FTrait.tag_link(tag=t))
         res.add(T.br())
-        pl = T.div(f'{fdate(self.when)} by', cls='permalink')
-        fusers = [self.FTrait.user_link(user=u) for u in self.users]
+        pl = T.div(f'{fdate(s.when)} by', cls='permalink')
+        fusers = [cls.FTrait.user_link(user=u) for u in s.users]
         for f in fusers:
             pl.add(T.span(f))
         res.add(pl)
@@ -489,53 +732,17 @@ class SpinboardCumulative(ForSpinboard, CumulativeBase):
 CumulativeBase.reg(SpinboardCumulative)
 
 class TentacleCumulative(ForTentacle, CumulativeBase):
-    @classproperty
-    def cumkey(cls):
-        return lambda x: id(x)
-
-    @classproperty
-    def sortkey(cls):
-        rev_when = invkey(lambda c: c.when)
-        return lambda c: (-c.stars, rev_when(c))
-
-    @cproperty
-    def stars(self) -> int:
-        # TODO vote for method??
-        return vote(i.stars for i in self.items)
-
-    def format(self):
-        item = the(self.items)
-        return self.FTrait.format_one(item)
+    @classmethod
+    def item_score(cls, x) -> int:
+        return x.stars
 
 
 CumulativeBase.reg(TentacleCumulative)
 
 class ReachCumulative(ForReach, CumulativeBase):
-    @cproperty
-    def the(self): return the(self.items)
-
-    @cproperty
-    def ups(self):
-        return self.the.ups
-
-    @cproperty
-    def downs(self):
-        return self.the.downs
-
-    @classproperty
-    def cumkey(cls):
-        return lambda x: id(x)
-
-    @classproperty
-    def sortkey(cls):
-        invwhen  = invkey(lambda c: c.when)
-        # invscore = invkey(lambda c: c.ups + c.downs)
-        # TODO wtf, invkey didn't work..
-        # return lambda c: (invscore(c), invwhen(c))
-        return lambda c: (-(c.ups + c.downs), invwhen(c))
-
-    def format(self):
-        return self.FTrait.format_one(self.the)
+    @classmethod
+    def item_score(cls, x) -> int:
+        return x.ups + x.downs
 
     @classmethod
     def sources_summary(cls, items):
@@ -550,26 +757,13 @@ CumulativeBase.reg(ReachCumulative)
 
 
 class TwitterCumulative(ForTwitter, CumulativeBase):
-    @cproperty
-    def the(self):
-        return the(self.items)
-
-    @cproperty
-    def interactions(self):
-        th = the(self.items)
-        return th.replies + th.retweets + th.likes
-
-    @classproperty
-    def cumkey(cls):
-        return lambda x: id(x) # TODO FIXME ???
-
-    @classproperty
-    def sortkey(cls):
-        invwhen  = invkey(when_key_tz_hack)
-        return lambda c: (-c.interactions, invwhen(c))
+    @classmethod
+    def item_when(cls, x) -> datetime:
+        return when_key_tz_hack(x)
 
-    def format(self):
-        return self.FTrait.format_one(self.the)
+    @classmethod
+    def item_score(cls, x) -> int:
+        return x.replies + x.retweets + x.likes
 
     @classmethod
     def sources_summary(cls, items):
@@ -585,26 +779,9 @@ CumulativeBase.reg(TwitterCumulative)
 
 
 class HackernewsCumulative(ForHackernews, CumulativeBase):
-    @cproperty
-    def the(self):
-        return the(self.items)
-
-    @classproperty
-    def cumkey(cls):
-        return lambda x: id(x) # TODO FIXME ???
-
-    @cproperty
-    def interactions(self):
-        th = the(self.items)
-        return th.points + th.comments
-
-    @classproperty
-    def sortkey(cls):
-        invwhen  = invkey(lambda c: c.when)
-        return lambda c: (-c.interactions, invwhen(c))
-
-    def format(self):
-        return self.FTrait.format_one(self.the)
+    @classmethod
+    def item_score(cls, x) -> int:
+        return x.points + x.comments
 
     @classmethod
     def sources_summary(cls, items):
@@ -638,11 +815,8 @@ def render_summary(repo: Path, digest: Changes[Any], rendered: Path) -> Path:
 
     before = len(everything)
 
-    grouped = group_by_key(everything, key=Cumulative.cumkey)
-    print(f'before: {before}, after: {len(grouped)}')
-
-    cumulatives = list(map(Cumulative, grouped.values()))
-    cumulatives = list(sorted(cumulatives, key=Cumulative.sortkey))
+    cumulatives = Cumulative.summarise(everything)
+    print(f'before: {before}, after: {len(cumulatives)}')
 
     doc = dominate.document(title=f'axol results for {name}, rendered at {fdate(NOW)}')
     with doc.head:
@@ -656,7 +830,7 @@ def render_summary(repo: Path, digest: Changes[Any], rendered: Path) -> Path:
         with T.div():
             Cumulative.sources_summary(everything)
         for cc in cumulatives:
-            T.div(cc.format(), cls='item')
+            T.div(Cumulative.format(cc), cls='item')
 
     rendered.mkdir(exist_ok=True, parents=True)
     sf = rendered.joinpath(name + '.html')
@@ -666,151 +840,345 @@ def render_summary(repo: Path, digest: Changes[Any], rendered: Path) -> Path:
 
 
 Item = Any # meh
+Group = Sequence[Tuple[datetime, Item]]
 
-def render_latest(repo: Path, digest, rendered: Path):
-    logger.info('processing %s', repo)
 
-    rtype = get_result_type(repo)
-    Format = FormatTrait.for_(rtype)
-    Ignore = IgnoreTrait.for_(rtype)
+def month_of(d: datetime) -> str:
+    return d.strftime('%Y-%m')
 
-    import pytz
-    NOW = datetime.now(tz=pytz.utc)
 
-    name = repo.stem
-    doc = dominate.document(title=f'axol results for {name}, rendered at {fdate(NOW)}')
+def min_dt(group: Group) -> datetime:
+    return min(g[0] for g in group)
 
-    with doc.head:
-        T.style(STYLE)
-        raw_script(JS)
 
-        T.link(rel='stylesheet', href="https://cdnjs.cloudflare.com/ajax/libs/codemirror/5.48.2/codemirror.min.css")
-        T.script(src='https://cdnjs.cloudflare.com/ajax/libs/codemirror/5.48.2/codemirror.js') # TODO use min?
+def month_groups(groups: Iterable[Group], month: str) -> Mapping[datetime, List[Group]]:
+    '''
+    Groups with occurrences during the month, along with the older occurrences, but not the later ones.
+    So the result is the same regardless of when it's computed, as long as the month is over.
+    '''
+    res: Dict[datetime, List[Group]] = {}
+    for group in groups:
+        during = [d for d, _ in group if month_of(d) == month]
+        if len(during) == 0:
+            continue
+        res.setdefault(min(during), []).append([(d, x) for d, x in group if month_of(d) <= month])
+    return res
+
+
+def recent_groups(groups: Iterable[Group], month: str) -> Mapping[datetime, List[Group]]:
+    '''
+    Groups with occurrences during the month (or later), along with the older occurrences
+    '''
+    res: Dict[datetime, List[Group]] = {}
+    for group in groups:
+        recent = [d for d, _ in group if month_of(d) >= month]
+        if len(recent) == 0:
+            continue
+        res.setdefault(min(recent), []).append(group)
+    return res
+
 
+def link_groups(digest) -> Tuple[List[Group], Mapping[datetime, List[Group]]]:
     citems: Iterator[Tuple[datetime, Item]] = chain.from_iterable(((d, x) for x in zz) for d, zz in digest.changes.items())
     # group according to link, so we can display already occuring items along with newer occurences
-    items2: List[Sequence[Tuple[datetime, Item]]] = [grp for  _, grp in group_by_key(citems, key=lambda p: f'{p[1].link}').items()]
+    items2: List[Group] = [grp for  _, grp in group_by_key(citems, key=lambda p: f'{p[1].link}').items()]
     # TODO sort within each group?
 
-    def min_dt(group: Sequence[Tuple[datetime, Item]]) -> datetime:
-        return min(g[0] for g in group)
-
     # TODO ok, this is def too many types here...
-    items3: Mapping[datetime, List[Sequence[Tuple[datetime, Item]]]] = group_by_key(items2, key=min_dt)
+    items3: Mapping[datetime, List[Group]] = group_by_key(items2, key=min_dt)
+    return items2, items3
 
-    rss = True
-    if rss:
-        # pip3 install feedgen
-        from feedgen.feed import FeedGenerator # type: ignore
-        fg = FeedGenerator()
-        # TODO memorize items?
-        fg.title(name)
-        fg.id('axol/' + name)
-        first = True
-        for d, items in sorted(items3.items()):
-            litems = list(items)
-            logger.info('%s %s: atom, dumping %d items', name, d, len(litems))
-            if first:
-                logger.info("SKIPPING first batch to prevent RSS bloat")
-                first = False
-                continue
-            for zz in litems:
-                fe = fg.add_entry()
-                # TODO not sure about css?
-                # TODO not sure which date should use? I gues crawling date makes more sense..
-                _d, z = zz[0] # TODO meh!
-                id_ = z.uid # TODO FIXME!!
-
-                fe.id(id_)
-                title = Format.title(zz) or '<no title>' # meh
-                fe.title(title)
-                fe.link(href=Format.link(zz))
-                # TODO not sure if it's a reasonable date to use...
-                fe.published(published=d)
-                fe.author(author={'name': z.user}) # TODO maybe, concat users?
-
-                ignored = Ignore.ignore_group(zz)
-                if ignored is not None:
-                    # TODO not sure if it highlights with read or something?
-                    content = ignored
-                else:
-                    content = Format.format(zz)
-
-                # eh, XML was complaining at some non-utf characters
-                content = str(content)
-
-                # https://stackoverflow.com/a/25920392/706389 make lxml happy...
-                content = re.sub(u'[^\u0020-\uD7FF\u0009\u000A\u000D\uE000-\uFFFD\U00010000-\U0010FFFF]+', '', content)
-                fe.content(content=content, type='CDATA')
-                # fe.updated(updated=NOW)
-
-                # TODO assemble a summary similar to HTML?
-                # fe.summary()
-        atomfeed = fg.atom_str(pretty=True)
-
-        # eh, my feed reader (miniflux) can't handle it if it's 'cdata'
-        # not sure which one is right
-        # ugh, that didn't work because escaping desicion is based on CDATA attribute...
-        atomfeed = atomfeed.replace(b'type="CDATA"', b'type="html"')
-        # fe._FeedEntry__atom_content['type'] = 'html'
-
-        atomdir = rendered / 'atom'
-        atomdir.mkdir(parents=True, exist_ok=True)
-        (atomdir / (name + '.xml')).write_bytes(atomfeed)
 
-    with doc:
-        with T.div(id='sidebar'):
-            T.label('Blacklisted:', for_='blacklisted')
-            T.div(id='blacklisted')
-            T.textarea(id='blacklist-edit', rows=10)
-            T.button('apply', id='blacklist-apply')
-
-
-        odd = True
-        for d, items in sorted(items3.items(), reverse=True):
-            litems = list(items)
-            odd = not odd
-            logger.info('%s %s: dumping %d items', name, d, len(litems))
-            with T.div(cls='day-changes'):
-                with T.div():
-                    T.b(fdate(d))
-                    T.span(f'{len(litems)} items')
-
-                with T.div(cls=f'day-changes-inner {"odd" if odd else "even"}'):
-                    for i in items:
-                        # TODO FIXME use getattr to specialise trait?
-                        # TODO FIXME ignore should be at changes collecting stage?
-
-                        ignored = Ignore.ignore_group(i)
-                        if ignored is not None:
-                            # TODO maybe let format result handle that... not sure
-                            T.div(ignored, cls='item ignored')
-                            # TODO log maybe?
-                            # TODO eh. need to handle in cumulatives...
-                        else:
-                            fi = Format.format(i)
+class FeedLimits(NamedTuple):
+    entries: int = 100
+    days: Optional[int] = 30 # relative to the most recent entry
+
+
+def feed_key(group: Group) -> str:
+    # NOTE: same as in link_groups, min_dt of the group stays the same as it gets new occurences
+    return f'{group[0][1].link}'
+
+
+FEED_VERSION = 3
+
+
+# entries generated during the previous runs, so only groups from new revisions need formatting
+class FeedState(NamedTuple):
+    version: str
+    upto: Optional[datetime] # groups up to this date are already in entries
+    entries: List[Json] # most recent first
+    limits: FeedLimits # entries were bounded by these
+
+
+def load_feed_state(path: Optional[Path], version: str, limits: FeedLimits) -> Optional[FeedState]:
+    if path is None or not path.exists():
+        return None
+    try:
+        with path.open('rb') as fo:
+            state = pickle.load(fo)
+    except Exception as e:
+        logger.warning('error while loading feed state %s, ignoring', path)
+        logger.exception(e)
+        return None
+    if not isinstance(state, FeedState) or state.version != version:
+        logger.info('feed state %s is stale, ignoring', path)
+        return None
+    if state.limits != limits:
+        logger.info('feed state %s was built with different limits, ignoring', path)
+        return None
+    return state
+
+
+def render_atom(repo: Path, digest, rendered: Path, cache_dir: Optional[Path]=None, limits: Optional[FeedLimits]=None, formatter: str='dom') -> Path:
+    if limits is None:
+        limits = FeedLimits()
+    rtype = get_result_type(repo)
+    Format = get_format(rtype, formatter)
+
+    name = repo.stem
+    atom = rendered / 'atom' / (name + '.xml')
+    state_path = None if cache_dir is None else cache_dir / (repo.name + '.feed')
+    fragments = FragmentCache(
+        path=None if cache_dir is None else cache_dir / (repo.name + '.atom.fragments'),
+        version=f'{RENDER_VERSION}:{Format.__name__}',
+    )
+    all_groups, groups = link_groups(digest)
+
+    version = f'{FEED_VERSION}:{render_version(repo)}'
+    state = load_feed_state(state_path, version, limits)
+    upto = None if state is None else state.upto
+
+    def render_entry(d: datetime, zz: Group) -> Json:
+        # TODO not sure which date should use? I gues crawling date makes more sense..
+        _d, z = zz[0] # TODO meh!
+        # NOTE: ignored items never make it into the digest (decisions are stored in the database)
+        content = fragments.render(group_key(zz), partial(Format.format, zz))
+        # https://stackoverflow.com/a/25920392/706389 make lxml happy...
+        # eh, XML was complaining at some non-utf characters
+        content = re.sub(u'[^\u0020-\uD7FF\u0009\u000A\u000D\uE000-\uFFFD\U00010000-\U0010FFFF]+', '', content)
+        return dict(
+            key=feed_key(zz),
+            id=z.uid, # TODO FIXME!!
+            title=Format.title(zz) or '<no title>', # meh
+            link=Format.link(zz),
+            # TODO not sure if it's a reasonable date to use...
+            published=d,
+            author=z.user, # TODO maybe, concat users?
+            content=content,
+        )
+
+    # NOTE: only the most recent groups are formatted, so it doesn't depend on the history length
+    entries: List[Json] = []
+    for d in sorted(groups, reverse=True):
+        if upto is not None and d <= upto:
+            break
+        if len(entries) >= limits.entries:
+            break
+        litems = groups[d]
+        logger.info('%s %s: atom, dumping %d items', name, d, len(litems))
+        entries.extend(render_entry(d, zz) for zz in litems)
+    if state is not None and upto is not None:
+        # older groups might have got new occurences since, their entries need rerendering
+        regrouped = {feed_key(zz): zz for zz in all_groups if max(g[0] for g in zz) > upto}
+        entries.extend(
+            render_entry(e['published'], regrouped[e['key']]) if e['key'] in regrouped else e
+            for e in state.entries
+        )
+    entries = entries[:limits.entries]
+    if limits.days is not None and len(entries) > 0:
+        cutoff = entries[0]['published'] - timedelta(days=limits.days)
+        entries = [e for e in entries if e['published'] >= cutoff]
+    if len(groups) > 0:
+        upto = max(groups)
+
+    # pip3 install feedgen
+    from feedgen.feed import FeedGenerator # type: ignore
+    fg = FeedGenerator()
+    fg.title(name)
+    fg.id('axol/' + name)
+    for e in reversed(entries):
+        fe = fg.add_entry()
+        # TODO not sure about css?
+        fe.id(e['id'])
+        fe.title(e['title'])
+        fe.link(href=e['link'])
+        fe.published(published=e['published'])
+        fe.author(author={'name': e['author']})
+        fe.content(content=e['content'], type='CDATA')
+        # TODO assemble a summary similar to HTML?
+    atomfeed = fg.atom_str(pretty=True)
+
+    # eh, my feed reader (miniflux) can't handle it if it's 'cdata'
+    # not sure which one is right
+    # ugh, that didn't work because escaping desicion is based on CDATA attribute...
+    atomfeed = atomfeed.replace(b'type="CDATA"', b'type="html"')
+    # fe._FeedEntry__atom_content['type'] = 'html'
+
+    atom.parent.mkdir(parents=True, exist_ok=True)
+    atom.write_bytes(atomfeed)
+
+    if state_path is not None:
+        state_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = state_path.with_name(state_path.name + f'.{os.getpid()}.{threading.get_ident()}.tmp')
+        with tmp.open('wb') as fo:
+            pickle.dump(FeedState(version=version, upto=upto, entries=entries, limits=limits), fo, protocol=pickle.HIGHEST_PROTOCOL)
+        tmp.replace(state_path)
+    fragments.save()
+    logger.info('%s: atom %s', name, fragments.stats())
+    fragments.close()
+    return atom
+
+
+def render_history(repo: Path, digest, rendered: Path, cache_dir: Optional[Path]=None, formatter: str='dom') -> Path:
+    logger.info('processing %s', repo)
+
+    rtype = get_result_type(repo)
+    Format = get_format(rtype, formatter)
+
+    name = repo.stem
+    fragments = FragmentCache(
+        path=None if cache_dir is None else cache_dir / (repo.name + '.fragments'),
+        version=f'{RENDER_VERSION}:{Format.__name__}',
+    )
+
+    import pytz
+    NOW = datetime.now(tz=pytz.utc)
+
+    items2, _ = link_groups(digest)
+
+    def page(path: Path, title: str, groups: Mapping[datetime, List[Group]], updated: Mapping[datetime, List[Item]], nav: Sequence[Tuple[str, str]]) -> None:
+        doc = dominate.document(title=title)
+
+        with doc.head:
+            T.style(STYLE)
+            raw_script(JS)
+
+            T.link(rel='stylesheet', href="https://cdnjs.cloudflare.com/ajax/libs/codemirror/5.48.2/codemirror.min.css")
+            T.script(src='https://cdnjs.cloudflare.com/ajax/libs/codemirror/5.48.2/codemirror.js') # TODO use min?
+
+        with doc:
+            with T.div(id='sidebar'):
+                T.label('Blacklisted:', for_='blacklisted')
+                T.div(id='blacklisted')
+                T.textarea(id='blacklist-edit', rows=10)
+                T.button('apply', id='blacklist-apply')
+
+        # NOTE: blocks are rendered & written one by one, so the whole DOM for large repos is never in memory
+        def blocks() -> Iterator[T.dom_tag]:
+            odd = True
+            for d, items in sorted(groups.items(), reverse=True):
+                litems = list(items)
+                odd = not odd
+                logger.info('%s %s: dumping %d items', name, d, len(litems))
+                with T.div(cls='day-changes') as block:
+                    with T.div():
+                        T.b(fdate(d))
+                        T.span(f'{len(litems)} items')
+
+                    with T.div(cls=f'day-changes-inner {"odd" if odd else "even"}'):
+                        for i in items:
+                            # TODO FIXME use getattr to specialise trait?
+                            # NOTE: ignored items are already filtered out at changes collecting stage
+                            fi = fragments.tag(group_key(i), partial(Format.format, i))
                             T.div(fi, cls='item')
-        # fucking hell.. didn't manage to render content inside iframe no matter how I tried..
-        # with T.iframe(id='blacklist', src=''):
-        #     pass
+                yield block
+
+            if len(updated) > 0:
+                yield T.h4('Updated')
+                for d, uitems in sorted(updated.items(), reverse=True):
+                    with T.div(cls='day-changes') as block:
+                        with T.div():
+                            T.b(fdate(d))
+                            T.span(f'{len(uitems)} updated')
+                        with T.div(cls='day-changes-inner'):
+                            for u in uitems:
+                                du = [(d, u)]
+                                T.div(fragments.tag(group_key(du), partial(Format.format, du)), cls='item updated')
+                    yield block
+
+            if len(nav) > 0:
+                with T.div(cls='archive') as block:
+                    T.h4('Archive')
+                    for text_, href in nav:
+                        T.div(T.a(text_, href=href))
+                yield block
+            # fucking hell.. didn't manage to render content inside iframe no matter how I tried..
+            # with T.iframe(id='blacklist', src=''):
+            #     pass
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with path.open('w') as fo:
+            stream_document(doc, fo, blocks())
+
+    def updated_in(month: str) -> Mapping[datetime, List[Item]]:
+        return {d: us for d, us in digest.updated.items() if month_of(d) == month}
+
+    # past months never change, so they are written once into immutable archive pages
+    # only the current month is rerendered on every run
+    months = sorted({month_of(d) for d in chain(digest.changes, digest.updated)})
+    current = months[-1] if len(months) > 0 else month_of(NOW)
+    past = months[:-1]
+
+    adir = rendered / name
+    index = adir / 'archive.json'
+    version = render_version(repo)
+    archived = set()
+    if index.exists():
+        stored = json.loads(index.read_text())
+        if stored['version'] == version:
+            archived = set(stored['months'])
+    for month in past:
+        if month in archived:
+            continue
+        logger.info('%s: archiving %s', name, month)
+        page(
+            adir / f'{month}.html',
+            title=f'axol results for {name}, {month}',
+            groups=month_groups(items2, month),
+            updated=updated_in(month),
+            nav=[('recent', f'../{name}.html')],
+        )
+        archived.add(month)
+    adir.mkdir(parents=True, exist_ok=True)
+    index.write_text(json.dumps({'version': version, 'months': sorted(archived)}))
 
-    # TODO perhaps needs to be iterative...
     rf = rendered / (name + '.html')
-    with rf.open('w') as fo:
-        fo.write(str(doc))
+    page(
+        rf,
+        title=f'axol results for {name}, rendered at {fdate(NOW)}',
+        groups=recent_groups(items2, current),
+        updated=updated_in(current),
+        nav=[(month, f'{name}/{month}.html') for month in reversed(past)],
+    )
+    fragments.save()
+    logger.info('%s: %s', name, fragments.stats())
+    fragments.close()
     return rf
 
 
+def render_latest(repo: Path, digest, rendered: Path, cache_dir: Optional[Path]=None, feed: Optional[FeedLimits]=None, formatter: str='dom') -> Path:
+    render_atom(repo, digest=digest, rendered=rendered, cache_dir=cache_dir, limits=feed, formatter=formatter)
+    return render_history(repo, digest=digest, rendered=rendered, cache_dir=cache_dir, formatter=formatter)
+
+
 def setup_parser(p):
-    from config import BASE_DIR, REPORTS_DIR
+    from config import BASE_DIR, REPORTS_DIR, CACHE_DIR
     p.add_argument('repos', nargs='*')
     p.add_argument('--with-summary', action='store_true')
     p.add_argument('--with-user-summary', action='store_true')
     p.add_argument('--last', type=int, default=None)
     # TODO rename output_dir?
     p.add_argument('--output-dir', type=Path, default=REPORTS_DIR)
+    p.add_argument('--cache-dir', type=Path, default=CACHE_DIR, help='Digest cache, so only new revisions are processed')
+    p.add_argument('--no-cache', action='store_const', const=None, dest='cache_dir', help='Compute digests from scratch')
     # TODO control via env variable instead? how to pass it to compose?
     p.add_argument('--serial', action='store_true', help='Do not use multithreading (useful for debugging)')
+    p.add_argument('--jobs', '-j', type=int, default=None, help='Number of workers (default: number of CPUs)')
+    p.add_argument('--threads', action='store_true', help='Use threads instead of processes, saves on pickling and imports')
+    p.add_argument('--force', action='store_true', help='Rerender all repos, even if they have not changed since the last render')
+    p.add_argument('--feed-entries', type=int, default=FeedLimits().entries, help='Max entries in the atom feeds')
+    p.add_argument('--feed-days', type=int, default=FeedLimits().days, help='Only keep atom entries from that many days before the most recent one')
+    p.add_argument('--formatter', choices=FORMATTERS, default='dom', help='HTML backend: dominate trees, or precompiled string templates (same output, faster)')
 
 
 # TODO for starters, just send last few days digest..
@@ -821,18 +1189,128 @@ def main():
     run(args)
 
 
-def do_repo(repo, output_dir, last, summary: bool) -> Path:
-    digest: Changes[Any] = get_digest(repo, last=last)
-    RENDERED = output_dir / 'rendered'
-    # TODO mm, maybe should return list of outputs..
-    res = render_latest(repo, digest=digest, rendered=RENDERED)
+# report tasks for a single repo. Digest goes first, the rest pick it up from the cache and can run in parallel
+# NOTE: tasks only return output paths, so the digest doesn't have to be pickled back to the parent process
+# workers: budget for decoding digests in parallel, see get_digest
+# NOTE: runs before the other tasks for the repo, so it's the only one writing to the database
+def do_digest(repo: Path, output_dir: Path, last, cache_dir: Optional[Path]=None, feed: Optional[FeedLimits]=None, formatter: str='dom', workers: Optional[int]=None) -> List[Path]:
+    get_digest(repo, last=last, cache_dir=cache_dir, workers=workers)
+    return []
+
+
+def do_history(repo: Path, output_dir: Path, last, cache_dir: Optional[Path]=None, feed: Optional[FeedLimits]=None, formatter: str='dom', workers: Optional[int]=None) -> List[Path]:
+    digest = get_digest(repo, last=last, cache_dir=cache_dir, workers=workers, store=False)
+    return [render_history(repo, digest=digest, rendered=output_dir / 'rendered', cache_dir=cache_dir, formatter=formatter)]
+
+
+def do_atom(repo: Path, output_dir: Path, last, cache_dir: Optional[Path]=None, feed: Optional[FeedLimits]=None, formatter: str='dom', workers: Optional[int]=None) -> List[Path]:
+    digest = get_digest(repo, last=last, cache_dir=cache_dir, workers=workers, store=False)
+    return [render_atom(repo, digest=digest, rendered=output_dir / 'rendered', cache_dir=cache_dir, limits=feed, formatter=formatter)]
+
+
+def do_summary(repo: Path, output_dir: Path, last, cache_dir: Optional[Path]=None, feed: Optional[FeedLimits]=None, formatter: str='dom', workers: Optional[int]=None) -> List[Path]:
+    digest = get_digest(repo, last=last, cache_dir=cache_dir, workers=workers, store=False)
+    return [render_summary(repo, digest=digest, rendered=output_dir / 'summary')]
+
+
+TASKS = {
+    'digest' : do_digest,
+    'history': do_history,
+    'atom'   : do_atom,
+    'summary': do_summary,
+}
+
 
+def do_repo(repo, output_dir, last, summary: bool, cache_dir: Optional[Path]=None, feed: Optional[FeedLimits]=None, formatter: str='dom', workers: Optional[int]=None) -> List[Path]:
+    # NOTE: not chaining TASKS, without the cache each of them would digest the whole database again
+    digest = get_digest(repo, last=last, cache_dir=cache_dir, workers=workers)
+    rendered = output_dir / 'rendered'
+    res = [
+        render_history(repo, digest=digest, rendered=rendered, cache_dir=cache_dir, formatter=formatter),
+        render_atom(repo, digest=digest, rendered=rendered, cache_dir=cache_dir, limits=feed, formatter=formatter),
+    ]
     if summary:
-        SUMMARY = output_dir/ 'summary'
-        res = render_summary(repo, digest=digest, rendered=SUMMARY)
+        res.append(render_summary(repo, digest=digest, rendered=output_dir / 'summary'))
     return res
 
 
+def timed(f, *args, **kwargs) -> Tuple[Any, float]:
+    start = time.perf_counter()
+    res = f(*args, **kwargs)
+    return res, time.perf_counter() - start
+
+
+class SerialExecutor(Executor):
+    def submit(self, fn, *args, **kwargs):
+        fut: Future = Future()
+        try:
+            fut.set_result(fn(*args, **kwargs))
+        except Exception as e:
+            fut.set_exception(e)
+        return fut
+
+
+def timings_table(timings: Sequence[Tuple[str, str, float]]) -> str:
+    rw = max([len('repo')] + [len(r) for r, _, _ in timings])
+    lines = [f'{"repo":<{rw}}  {"task":<8}  {"time":>8}']
+    for r, k, took in sorted(timings, key=lambda t: -t[2]):
+        lines.append(f'{r:<{rw}}  {k:<8}  {took:7.2f}s')
+    return '\n'.join(lines)
+
+
+# bump when rendering changes in a way that isn't captured by the style/js/digest versions
+RENDER_VERSION = 2
+
+def render_version(repo: Path) -> str:
+    rtype = get_result_type(repo)
+    key = repr((RENDER_VERSION, STYLE, JS, digest_version(rtype, repo.stem)))
+    return hashlib.sha1(key.encode('utf8')).hexdigest()
+
+
+# per repo: the revision and versions it was last rendered with, and hashes of the outputs
+Manifest = Dict[str, Json]
+
+def manifest_path(output_dir: Path) -> Path:
+    return output_dir / 'manifest.json'
+
+
+def load_manifest(output_dir: Path) -> Manifest:
+    mf = manifest_path(output_dir)
+    if not mf.exists():
+        return {}
+    try:
+        return json.loads(mf.read_text())
+    except Exception as e:
+        logger.warning('error while loading render manifest %s, ignoring', mf)
+        logger.exception(e)
+        return {}
+
+
+def save_manifest(output_dir: Path, manifest: Manifest) -> None:
+    mf = manifest_path(output_dir)
+    tmp = mf.with_suffix('.tmp')
+    tmp.write_text(json.dumps(manifest, indent=1, sort_keys=True))
+    tmp.replace(mf)
+
+
+def file_hash(path: Path) -> str:
+    return hashlib.blake2b(path.read_bytes(), digest_size=16).hexdigest()
+
+
+# state: revision/version/options the repo is about to be rendered with
+def up_to_date(entry: Optional[Json], state: Json, output_dir: Path) -> bool:
+    if entry is None:
+        return False
+    if any(entry.get(k) != v for k, v in state.items()):
+        return False
+    # outputs might have been removed or modified by hand
+    for rel, h in entry['outputs'].items():
+        o = output_dir / rel
+        if not o.exists() or file_hash(o) != h:
+            return False
+    return True
+
+
 class Storage(NamedTuple):
     path: Path
 
@@ -842,7 +1320,7 @@ class Storage(NamedTuple):
 
     @property
     def source(self) -> str:
-        return get_result_type(self.path)
+        return for_repo(self.path).name
 
 
 def get_all_storages() -> Sequence[Storage]:
@@ -850,6 +1328,12 @@ def get_all_storages() -> Sequence[Storage]:
 
 
 def run(args):
+    if args.cache_dir is None:
+        # digests still need to be shared between report stages within the run
+        from tempfile import TemporaryDirectory
+        with TemporaryDirectory() as td:
+            return run(argparse.Namespace(**{**vars(args), 'cache_dir': Path(td)}))
+
     res: List[Storage]
     if len(args.repos) > 0:
         repos = [Storage(DATABASES / r) for r in args.repos]
@@ -857,39 +1341,102 @@ def run(args):
         repos = get_all_storages()
 
     assert len(repos) > 0
-    logger.info('will be processing %s', repos)
 
     storages = repos
     odir = args.output_dir
 
     odir.mkdir(exist_ok=True)
 
-    if args.with_user_summary:
-        user_summary(repos, output_dir=args.output_dir)
+    manifest = load_manifest(odir)
+    feed = FeedLimits(entries=args.feed_entries, days=args.feed_days)
+    # NOTE: everything that affects the outputs, so changing them triggers a rerender
+    options = {'last': args.last, 'summary': args.with_summary, 'feed': feed._asdict(), 'formatter': args.formatter}
+    states = {}
+    todo = []
+    for repo in repos:
+        state = {
+            'revision': DbReader(repo.path).latest_revision(),
+            'version' : render_version(repo.path),
+            'options' : options,
+        }
+        if not args.force and up_to_date(manifest.get(repo.name), state, odir):
+            logger.debug('%s: up to date, skipping', repo.name)
+            continue
+        states[repo.name] = state
+        todo.append(repo)
+    logger.info('will be processing %s (%d/%d repos changed since the last render)', todo, len(todo), len(repos))
 
     # TODO would be cool to do some sort of parallel logging? 
     # maybe some sort of rolling log using the whole terminal screen?
     errors: List[str] = []
 
+    kinds = ['history', 'atom'] + (['summary'] if args.with_summary else [])
+    # largest first, so the biggest repos don't end up stretching the total runtime
+    todo = sorted(todo, key=lambda r: r.path.stat().st_size, reverse=True)
+    outputs: Dict[str, List[Path]] = {r.name: [] for r in todo}
+    failed = set()
+    timings: List[Tuple[str, str, float]] = []
+
+    pool: Executor
     if args.serial:
-        # todo ugh, figure out how to do it easier... 
-        from kython.koncurrent import DummyExecutor
-        pool = DummyExecutor()
+        pool = SerialExecutor()
+    elif args.threads:
+        pool = ThreadPoolExecutor(max_workers=args.jobs)
     else:
-        pool = ProcessPoolExecutor()
+        pool = ProcessPoolExecutor(max_workers=args.jobs)
+    # tasks running in a pool already keep the cores busy, so they shouldn't start pools of their own
+    workers = args.jobs if args.serial else 1
+    started = time.perf_counter()
     with pool:
-        # TODO this is just pool map??
-        futures = []
-        for repo in repos:
-            futures.append(pool.submit(do_repo, repo.path, output_dir=args.output_dir, last=args.last, summary=args.with_summary))
-        for r, f in zip(repos, futures):
-            try:
-                f.result()
-            except Exception as e:
-                logger.error('while processing %s', r)
-                logger.exception(e)
-                err = f'while processing {r}: {e}'
-                errors.append(err)
+        running: Dict[Future, Tuple[Storage, str]] = {}
+        def submit(repo: Storage, kind: str) -> None:
+            f = pool.submit(timed, TASKS[kind], repo.path, output_dir=odir, last=args.last, cache_dir=args.cache_dir, feed=feed, formatter=args.formatter, workers=workers)
+            running[f] = (repo, kind)
+
+        for repo in todo:
+            submit(repo, 'digest')
+        while len(running) > 0:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for f in done:
+                r, kind = running.pop(f)
+                try:
+                    res, took = f.result()
+                except Exception as e:
+                    logger.error('while processing %s (%s)', r, kind)
+                    logger.exception(e)
+                    err = f'while processing {r} ({kind}): {e}'
+                    errors.append(err)
+                    failed.add(r.name)
+                    continue
+                timings.append((r.name, kind, took))
+                outputs[r.name].extend(res)
+                if kind == 'digest':
+                    for k in kinds:
+                        submit(r, k)
+    if len(timings) > 0:
+        print(timings_table(timings))
+        print(f'total: {time.perf_counter() - started:.2f}s')
+
+    for r in todo:
+        if r.name in failed:
+            # make sure it's rerendered next time
+            manifest.pop(r.name, None)
+        else:
+            manifest[r.name] = {
+                **states[r.name],
+                'outputs': {str(o.relative_to(odir)): file_hash(o) for o in outputs[r.name]},
+            }
+    save_manifest(odir, manifest)
+
+    # NOTE: runs after do_repo, so digests are picked up from the cache
+    if args.with_user_summary:
+        # user summaries aggregate over all repos of the same source
+        changed = {r.source for r in todo}
+        # e.g. previous runs were without --with-user-summary
+        changed |= {r.source for r in repos if not (odir / (r.source + '_users.html')).exists()}
+        if args.force:
+            changed = {r.source for r in repos}
+        user_summary([r for r in repos if r.source in changed], output_dir=args.output_dir, cache_dir=args.cache_dir, jobs=args.jobs)
 
     # TODO put errors on index page?
     write_index(storages, odir)
@@ -957,27 +1504,34 @@ def write_index(storages, output_dir: Path):
     (output_dir / 'index.html').write_text(str(doc))
 
 
-def user_summary(storages, output_dir: Path):
+def user_summary(storages, output_dir: Path, cache_dir: Optional[Path]=None, jobs: Optional[int]=None):
     for src, st in group_by_key(storages, key=lambda s: s.source).items():
-        rtype = the(get_result_type(x) for x in st)
-        outf = output_dir / (For(src).name + '_users.html')
-        user_summary_for(rtype=rtype, storages=st, output_path=outf)
+        rtype = for_source(src).Target
+        outf = output_dir / (src + '_users.html')
+        user_summary_for(rtype=rtype, storages=st, output_path=outf, cache_dir=cache_dir, jobs=jobs)
+
+
+# only returns the counts, so the whole digest doesn't have to be pickled back to the parent process
+def user_counts(repo: Path, cache_dir: Optional[Path]=None) -> Dict[str, int]:
+    # NOTE: runs in a pool, so no nested pools
+    digest = get_digest(repo, cache_dir=cache_dir, workers=1, store=False)
+    everything = flatten([ch for ch in digest.changes.values()])
+    return dict(Counter(x.user for x in everything))
 
 
-def user_summary_for(rtype, storages, output_path: Path):
+def user_summary_for(rtype, storages, output_path: Path, cache_dir: Optional[Path]=None, jobs: Optional[int]=None):
     ustats = {}
     def reg(user, query, stats):
         if user not in ustats:
             ustats[user] = {}
         ustats[user][query] = stats
 
-    with ProcessPoolExecutor() as pp:
-        digests = pp.map(get_digest, [s.path for s in storages])
+    with ProcessPoolExecutor(max_workers=jobs) as pp:
+        counts = pp.map(partial(user_counts, cache_dir=cache_dir), [s.path for s in storages])
 
-    for s, digest in zip(storages, digests):
-        everything = list(flatten([ch for ch in digest.changes.values()]))
-        for user, items in group_by_key(everything, key=lambda x: x.user).items():
-            reg(user, s.name, len(items))
+    for s, cnts in zip(storages, counts):
+        for user, cnt in cnts.items():
+            reg(user, s.name, cnt)
 
     now = datetime.now()
     doc = dominate.document(title=f'axol tags summary for {[s.name for s in storages]}, rendered at {fdate(now)}')
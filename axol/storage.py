@@ -1,84 +1,476 @@
 import gc
+import multiprocessing
+import hashlib
 import json
 import os
+import threading
+import pickle
 import re
+import sqlite3
 import time
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+from functools import partial
 from pathlib import Path
 from subprocess import DEVNULL, check_output, run
-from typing import Dict, Generic, Iterator, List, Tuple, Type, TypeVar, Any, Iterable
+from itertools import groupby
+from typing import Callable, Dict, Generic, Iterator, List, NamedTuple, Optional, Sequence, Set, Tuple, Type, TypeVar, Any, Iterable
 
-from .common import logger, slugify
+from .common import ichunks, logger, slugify
 from .jsonify import JsonTrait
-from .traits import get_result_type, ignore_result
-from .database import Revision, Json, Jsons, DbReader
+from .traits import get_result_type, IgnoreTrait, IgnoreRes, UpdateTrait
+from .database import Revision, Json, Jsons, DbReader, Row, RowKey, tracked_hash, migrate
+
+import sqlalchemy.exc # type: ignore
+
+
+# once there are more uids than that, they are spilled onto disk
+SPILL_THRESHOLD = 500_000
+
+# hash of the tracked fields, so updates are detected without keeping/comparing whole items
+# NOTE: same as the hashes DbWriter stores along with the rows, so they can be compared without decoding
+Hash = Optional[bytes]
+
+def content_hash(item, tracked: Sequence[str]) -> Hash:
+    if len(tracked) == 0:
+        return None
+    return tracked_hash([getattr(item, f) for f in tracked])
 
 
-# TODO FIXME should rely on a DB here
-# TODO I guess need to compare here?
 class Collector:
-    def __init__(self):
-        self.items: Dict[str, Any] = {}
+    """
+    Only tracks uids of registered items along with hashes of their tracked fields (items themselves end up in Changes).
+    If spill_threshold is set, uids beyond it are moved into a temporary sqlite table to bound memory usage.
+    """
+    def __init__(self, spill_threshold: Optional[int]=None, tracked: Sequence[str]=()) -> None:
+        self.spill_threshold = spill_threshold
+        self.tracked = tuple(tracked)
+        self.hashes: Dict[str, Hash] = {}
+        self._spilled: Optional[sqlite3.Connection] = None
+
+    def _get(self, uid: str) -> Tuple[bool, Hash]:
+        if uid in self.hashes:
+            return True, self.hashes[uid]
+        if self._spilled is None:
+            return False, None
+        res = self._spilled.execute('SELECT hash FROM uids WHERE uid = ?', (uid,)).fetchone()
+        if res is None:
+            return False, None
+        return True, res[0]
+
+    def __contains__(self, uid: str) -> bool:
+        found, _ = self._get(uid)
+        return found
+
+    def get_hash(self, uid: str) -> Hash:
+        _, h = self._get(uid)
+        return h
+
+    def changed(self, uid: str, h: Hash) -> bool:
+        return h != self.get_hash(uid)
+
+    def __len__(self) -> int:
+        res = len(self.hashes)
+        if self._spilled is not None:
+            [(spilled,)] = self._spilled.execute('SELECT COUNT(*) FROM uids')
+            res += spilled
+        return res
+
+    def items(self) -> Iterator[Tuple[str, Hash]]:
+        yield from self.hashes.items()
+        if self._spilled is not None:
+            yield from self._spilled.execute('SELECT uid, hash FROM uids')
+
+    def __iter__(self) -> Iterator[str]:
+        for uid, _ in self.items():
+            yield uid
+
+    def _set(self, uid: str, h: Hash) -> None:
+        self.hashes[uid] = h
+        if self.spill_threshold is not None and len(self.hashes) > self.spill_threshold:
+            self._spill()
+
+    def _spill(self) -> None:
+        if self._spilled is None:
+            # empty name means a temporary on-disk database, removed on close
+            self._spilled = sqlite3.connect('')
+            self._spilled.execute('CREATE TABLE uids (uid TEXT PRIMARY KEY, hash BLOB)')
+        with self._spilled:
+            self._spilled.executemany('INSERT INTO uids VALUES (?, ?)', self.hashes.items())
+        logger.debug('spilled %d uids onto disk', len(self.hashes))
+        self.hashes = {}
 
     def register(self, batch):
         added = []
         for i in batch:
-            if i.uid in self.items:
-                pass # TODO FIXME compare? if description or tags changed, report it?
+            if i.uid in self:
+                pass # NOTE: changes of already registered items are handled by update()
             else:
                 added.append(i)
-                self.items[i.uid] = i
+                self._set(i.uid, content_hash(i, self.tracked))
         return added
 
+    def update(self, item) -> bool:
+        """
+        Returns True if tracked fields of an already registered item changed since it was last seen
+        """
+        found, old = self._get(item.uid)
+        assert found, item.uid
+        new = content_hash(item, self.tracked)
+        if new == old:
+            return False
+        if item.uid in self.hashes or self._spilled is None:
+            self.hashes[item.uid] = new
+        else:
+            with self._spilled:
+                self._spilled.execute('UPDATE uids SET hash = ? WHERE uid = ?', (new, item.uid))
+        return True
+
+    # NOTE: pickled for the digest cache
+    def __getstate__(self):
+        return {'spill_threshold': self.spill_threshold, 'tracked': self.tracked, 'hashes': list(self.items())}
+
+    def __setstate__(self, state) -> None:
+        self.__init__(spill_threshold=state['spill_threshold'], tracked=state['tracked']) # type: ignore[misc]
+        for uid, h in state['hashes']:
+            self._set(uid, h)
+
 R = TypeVar('R')
 
 # TODO uh. kinda pointless class... could just be a dict?
 class Changes(Generic[R]):
     def __init__(self) -> None:
         self.changes: Dict[datetime, List[R]] = {}
+        # already reported items, which changed since
+        self.updated: Dict[datetime, List[R]] = {}
     # method to format everything?
 
     def add(self, rev: datetime, items) -> None:
         assert rev not in self.changes # TODO not sure
         self.changes[rev] = items
 
+    def add_updated(self, rev: datetime, items) -> None:
+        assert rev not in self.updated
+        self.updated[rev] = items
+
     def __len__(self):
         return sum(len(x) for x in self.changes.values())
 
-# TODO html mode??
-def get_digest(repo: Path, last=None) -> Changes[R]:
-    rtype = get_result_type(repo)
-    Trait = JsonTrait.for_(rtype)
-    from_json = Trait.from_json
+# bump when digest logic changes, to invalidate the caches
+DIGEST_VERSION = 5
 
-    rh = DbReader(repo)
-    # TODO need to update pinboard?
-    # ustats = get_user_stats(jsons, rtype=rtype)
-    ustats = None
 
-    # TODO shit. should have stored metadata in repository?... for now guess from filename..
+# bump when ignore logic changes, to invalidate ignore decisions stored in the databases
+IGNORE_VERSION = 1
 
-    cc = Collector()
-    changes: Changes[R] = Changes()
-    # TODO maybe collector can figure it out by itself? basically track when the item was 'first se
-    # TODO would be interesting to have non-consuming slice...
-    for jj in rh.iter_versions(last=last):
-        rev, dd, j = jj
+
+def ignore_config(rtype, repo: str) -> str:
+    Ignore = IgnoreTrait.for_(rtype)
+    key = repr((IGNORE_VERSION, Ignore.__module__, Ignore.__name__, Ignore.config(repo)))
+    return hashlib.sha1(key.encode('utf8')).hexdigest()
+
+
+def digest_version(rtype, repo: str) -> str:
+    Update = UpdateTrait.for_(rtype)
+    key = repr((DIGEST_VERSION, rtype.__module__, rtype.__name__, rtype._fields, ignore_config(rtype, repo), Update.tracked))
+    return hashlib.sha1(key.encode('utf8')).hexdigest()
+
+
+# (mtime, size) of the database file
+DbStamp = Tuple[int, int]
+
+def db_stamp(repo: Path) -> DbStamp:
+    st = repo.stat()
+    return (st.st_mtime_ns, st.st_size)
+
+
+# state of get_digest after processing all revisions up to 'revision'
+class DigestCache(NamedTuple):
+    version: str
+    stamp: DbStamp # if the database didn't change, cached digest is used straightaway
+    revision: Optional[Revision]
+    rows: int # total rows up to revision, to detect if the database was rewritten
+    collector: Collector
+    changes: Changes
+
+
+def digest_cache_path(cache_dir: Path, repo: Path) -> Path:
+    # NOTE: databases with the same name might be in different directories
+    key = hashlib.sha1(str(repo.resolve()).encode('utf8')).hexdigest()[:10]
+    return cache_dir / f'{repo.name}.{key}.digest'
+
+
+def load_digest_cache(path: Path, version: str, rh: DbReader, stamp: DbStamp) -> Optional[DigestCache]:
+    if not path.exists():
+        return None
+    try:
+        with path.open('rb') as fo:
+            cache = pickle.load(fo)
+    except Exception as e:
+        logger.warning('error while loading digest cache %s, ignoring', path)
+        logger.exception(e)
+        return None
+    if not isinstance(cache, DigestCache) or cache.version != version:
+        logger.info('digest cache %s is stale, ignoring', path)
+        return None
+    if cache.stamp == stamp:
+        return cache
+    if rh.count(upto=cache.revision) != cache.rows:
+        logger.warning('%s changed since digest cache %s was written, ignoring', rh.repo, path)
+        return None
+    return cache
+
+
+def save_digest_cache(path: Path, cache: DigestCache) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # NOTE: report tasks for the same repo might race to write it
+    tmp = path.with_name(path.name + f'.{os.getpid()}.{threading.get_ident()}.tmp')
+    with tmp.open('wb') as fo:
+        pickle.dump(cache, fo, protocol=pickle.HIGHEST_PROTOCOL)
+    tmp.replace(path)
+
+
+Ignorer = Callable[[Any], IgnoreRes]
+
+# (revision, added, updated)
+Added = Iterator[Tuple[Revision, datetime, List[Any], List[Any]]]
+
+# reference implementation: goes through every row of every revision
+def _added_scan(rh: DbReader, cc: Collector, from_json, ignore: Ignorer, after: Optional[Revision], upto: Revision) -> Added:
+    hashes_valid = rh.hashes_valid(cc.tracked)
+    for rev, dd, rows in rh.iter_rows(after=after, upto=upto):
         items = []
+        updated = []
 
-        for x in j:
-            item = from_json(x)
-            ignored = ignore_result(item)
+        for row in rows:
+            if row.uid in cc:
+                # already registered, so it wouldn't be added anyway; only need to decode if tracked fields changed
+                if len(cc.tracked) > 0 and not (hashes_valid and row.thash is not None and not cc.changed(row.uid, row.thash)):
+                    uitem, _, _ = _decoded(from_json, ignore, row)
+                    if uitem is not None and cc.update(uitem):
+                        updated.append(uitem)
+                continue
+            item = from_json(row.json)
+            ignored = ignore(item)
             if ignored is not None:
                 logger.debug('ignoring due to %s', ignored)
                 continue
             # TODO would be nice to propagate and render... also not collect such items in the first place??
             items.append(item)
 
-
         added = cc.register(items)
         #print(f'revision {rev}: total {len(cc.items)}')
         #print(f'added {len(added)}')
+        yield rev, dd, added, updated
+
+
+# rows to decode, below that process pool isn't worth the overhead
+PARALLEL_THRESHOLD = 200_000
+
+
+def _can_fork() -> bool:
+    # if we're a worker ourselves, the cores are already busy (e.g. report --jobs), nested pool would only oversubscribe them
+    # and forking a multithreaded process (e.g. report --threads) isn't safe
+    return multiprocessing.parent_process() is None and threading.active_count() == 1
+
+
+# (item or None if it's ignored, ignore reason, whether the decision is new, i.e. wasn't cached in the database)
+Decision = Tuple[Optional[Any], IgnoreRes, bool]
+
+def _decoded(from_json, ignore: Ignorer, row: Row) -> Decision:
+    if row.cached and row.reason is not None:
+        # no need to even decode it
+        return None, row.reason, False
+    item = from_json(row.json)
+    if row.cached:
+        return item, None, False
+    ignored = ignore(item)
+    if ignored is not None:
+        logger.debug('ignoring due to %s', ignored)
+        return None, ignored, True
+    return item, None, True
+
+
+def ignorer_for(repo: Path) -> Ignorer:
+    return IgnoreTrait.for_(get_result_type(repo)).ignorer(repo.stem)
+
+
+# runs in a worker process
+def _decode_chunk(repo: Path, ignore_config: str, keys: List[RowKey]) -> List[Decision]:
+    from_json = JsonTrait.for_(get_result_type(repo)).decoder()
+    ignore = ignorer_for(repo)
+    return [_decoded(from_json, ignore, row) for row in DbReader(repo).iter_keyed_rows(keys, ignore_config=ignore_config)]
+
+
+def _split_revisions(keys: List[RowKey], parts: int) -> List[List[RowKey]]:
+    # each chunk is a contiguous range of revisions
+    size = max(1, len(keys) // parts)
+    chunks: List[List[RowKey]] = [[]]
+    for _, group in groupby(keys, key=lambda k: k[2]):
+        if len(chunks[-1]) >= size:
+            chunks.append([])
+        chunks[-1].extend(group)
+    return chunks
+
+
+Decoded = Iterator[Tuple[RowKey, Decision]]
+
+def _decode_parallel(repo: Path, keys: List[RowKey], ignore_config: str, workers: int) -> Decoded:
+    chunks = _split_revisions(keys, parts=workers * 4)
+    logger.debug('%s: decoding %d rows in %d chunks', repo, len(keys), len(chunks))
+    with ProcessPoolExecutor(max_workers=workers) as pp:
+        # NOTE: map returns the chunks in order, so the items are merged in revision order
+        for chunk, items in zip(chunks, pp.map(partial(_decode_chunk, repo, ignore_config), chunks)):
+            yield from zip(chunk, items)
+
+
+def _iter_decoded(rh: DbReader, keys: List[RowKey], from_json, ignore: Ignorer, ignore_config: str, workers: int) -> Decoded:
+    if workers > 1:
+        yield from _decode_parallel(rh.repo, keys, ignore_config=ignore_config, workers=workers)
+    else:
+        for row in rh.iter_keyed_rows(keys, ignore_config=ignore_config):
+            yield (row.rowid, row.uid, row.revision), _decoded(from_json, ignore, row)
+
+
+# same result as _added_scan, but only decodes the rows in which each uid was first seen
+# (or later rows, if the earlier ones were ignored)
+# workers: max number of processes to decode with (default: number of CPUs). The pool is only used past PARALLEL_THRESHOLD rows,
+# and only if it's safe to start one from here (see _can_fork)
+# decisions: new ignore decisions (rowid -> reason) end up there, so they can be stored in the database
+# hashes: tracked hashes of decoded rows that didn't have them stored (older databases), same
+def _added_first_seen(rh: DbReader, cc: Collector, from_json, ignore: Ignorer, after: Optional[Revision], upto: Revision, ignore_config: str, decisions: Dict[int, IgnoreRes], hashes: Optional[Dict[int, bytes]]=None, workers: Optional[int]=None) -> Added:
+    if hashes is None:
+        hashes = {}
+    added: List[Tuple[Revision, int, Any]] = []
+    pending: Dict[str, Revision] = {} # uid -> first seen revision, if it was ignored
+
+    def decided(rowid: int, decision: Decision) -> Optional[Any]:
+        item, reason, new = decision
+        if new:
+            decisions[rowid] = reason
+        return item
+
+    def process(rowid: int, uid: str, revision: Revision, item: Optional[Any]) -> None:
+        if item is None: # ignored
+            pending.setdefault(uid, revision)
+            return
+        cc.register([item])
+        added.append((revision, rowid, item))
+
+    # NOTE: checking before decoding, the row may be a duplicate within the same revision
+    def process_row(row: Row) -> None:
+        if row.uid in cc:
+            return
+        process(row.rowid, row.uid, row.revision, decided(row.rowid, _decoded(from_json, ignore, row)))
+
+    keys = rh.first_seen(after=after, upto=upto, skip=cc.__contains__)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if len(keys) < PARALLEL_THRESHOLD or not _can_fork():
+        workers = 1
+    for (rowid, uid, revision), decision in _iter_decoded(rh, keys, from_json=from_json, ignore=ignore, ignore_config=ignore_config, workers=workers):
+        item = decided(rowid, decision)
+        if uid in cc:
+            continue
+        process(rowid, uid, revision, item)
+
+    # first seen rows for these were ignored, so need to check the later ones
+    unresolved = [u for u in pending if u not in cc]
+    if len(unresolved) > 0:
+        for row in rh.iter_uid_rows(unresolved, after=after, upto=upto, ignore_config=ignore_config):
+            if row.revision > pending[row.uid]:
+                process_row(row)
+
+    updated: List[Tuple[Revision, int, Any]] = []
+    if len(cc.tracked) > 0:
+        # only rows from revisions after the item was registered can be updates
+        registered = {item.uid: rev for rev, _, item in added}
+        # only rows where tracked fields differ from the previous row of the same uid need decoding
+        # NOTE: strictly speaking, if the previous row was ignored, this one might not be (and would be an update)
+        # but ignore decisions don't normally change without tracked fields changing
+        last: Dict[str, Hash] = {}
+        ukeys: List[RowKey] = []
+        missing: Set[int] = set()
+        for rowid, uid, revision, h in rh.row_hashes(cc.tracked, after=after, upto=upto):
+            if uid not in cc or revision <= registered.get(uid, ''):
+                continue
+            if h is None:
+                missing.add(rowid)
+            else:
+                prev = last[uid] if uid in last else cc.get_hash(uid)
+                last[uid] = h
+                if h == prev:
+                    continue
+            ukeys.append((rowid, uid, revision))
+        for (rowid, uid, revision), decision in _iter_decoded(rh, ukeys, from_json=from_json, ignore=ignore, ignore_config=ignore_config, workers=workers):
+            item = decided(rowid, decision)
+            if item is not None and rowid in missing:
+                hashes[rowid] = content_hash(item, cc.tracked)
+            if item is not None and cc.update(item):
+                updated.append((revision, rowid, item))
+
+    by_rev: Dict[Revision, Tuple[List[Any], List[Any]]] = {}
+    for idx, lst in enumerate([added, updated]):
+        lst.sort(key=lambda x: (x[0], x[1]))
+        for rev, _, item in lst:
+            by_rev.setdefault(rev, ([], []))[idx].append(item)
+    for rev in sorted(by_rev):
+        a, u = by_rev[rev]
+        yield rev, datetime.fromisoformat(rev), a, u
+
+
+# TODO html mode??
+# cache_dir: if passed, digest is cached there and only new revisions are processed next time
+# it's also the way to share digests between different report stages (they run in different processes)
+# store: write new ignore decisions/tracked hashes back into the database. report only does it in a single step per database,
+# so the stages running concurrently only read it
+def get_digest(repo: Path, last=None, cache_dir: Optional[Path]=None, first_seen: bool=True, workers: Optional[int]=None, store: bool=True) -> Changes[R]:
+    rtype = get_result_type(repo)
+    Trait = JsonTrait.for_(rtype)
+    # NOTE: fresh decoder, so interned values don't outlive the digest
+    from_json = Trait.decoder()
+
+    rh = DbReader(repo)
+    # TODO need to update pinboard?
+
+    # TODO shit. should have stored metadata in repository?... for now guess from filename..
+
+    version = digest_version(rtype, repo.stem)
+    stamp = db_stamp(repo)
+    cache_path = None if cache_dir is None else digest_cache_path(cache_dir, repo)
+    cache = None if cache_path is None else load_digest_cache(cache_path, version=version, rh=rh, stamp=stamp)
+
+    if cache is not None and cache.stamp == stamp:
+        logger.debug('%s: unchanged since digest cache', repo)
+        return cache.changes
+    if cache is not None:
+        cc = cache.collector
+        changes: Changes[R] = cache.changes
+        after = cache.revision
+        logger.debug('%s: using digest cache up to %s', repo, after)
+    else:
+        cc = Collector(spill_threshold=SPILL_THRESHOLD, tracked=UpdateTrait.for_(rtype).tracked)
+        changes = Changes()
+        after = None
+    # NOTE: crawler might be adding revisions concurrently, so need to fix the range
+    upto = rh.latest_revision()
+    if upto is None:
+        return changes
+
+    # TODO maybe collector can figure it out by itself? basically track when the item was 'first se
+    # TODO would be interesting to have non-consuming slice...
+    assert last is None # not sure if I need it??
+    iconfig = ignore_config(rtype, repo.stem)
+    ignore = ignorer_for(repo)
+    decisions: Dict[int, IgnoreRes] = {}
+    hashes: Dict[int, bytes] = {}
+    if first_seen:
+        iter_added = _added_first_seen(rh=rh, cc=cc, from_json=from_json, ignore=ignore, after=after, upto=upto, ignore_config=iconfig, decisions=decisions, hashes=hashes, workers=workers)
+    else:
+        iter_added = _added_scan(rh=rh, cc=cc, from_json=from_json, ignore=ignore, after=after, upto=upto)
+    for rev, dd, added, updated in iter_added:
+        if len(updated) > 0:
+            changes.add_updated(dd, list(sorted(updated, key=lambda e: e.when, reverse=True)))
         # if first:
         if len(added) == 0:
             continue
@@ -99,9 +491,60 @@ def get_digest(repo: Path, last=None) -> Changes[R]:
 #                # TODO how to track which ones were already notified??
 #                # TODO I guess keep latest revision in a state??
 
+    stored = False
+    if store and (len(hashes) > 0 or len(decisions) > 0):
+        try:
+            logger.debug('%s: storing %d tracked hashes', repo, len(hashes))
+            rh.save_hashes(cc.tracked, hashes)
+            logger.debug('%s: storing %d ignore decisions', repo, len(decisions))
+            rh.save_ignores(iconfig, decisions)
+            stored = True
+        except sqlalchemy.exc.OperationalError as e:
+            # e.g. locked by the crawler. not a big deal, they are just going to be recomputed next time
+            logger.warning("%s: couldn't store ignore decisions/tracked hashes: %s", repo, e)
+    if stored:
+        # otherwise digest cache wouldn't be used straightaway next time
+        # NOTE: stamp is only safe to update if the crawler hasn't added anything in the meantime
+        new_stamp = db_stamp(repo)
+        if rh.latest_revision() == upto:
+            stamp = new_stamp
+
+    if cache_path is not None:
+        save_digest_cache(cache_path, DigestCache(
+            version=version,
+            stamp=stamp,
+            revision=upto,
+            rows=rh.count(upto=upto),
+            collector=cc,
+            changes=changes,
+        ))
     return changes
 
 
+def rescan_ignores(repo: Path, chunk: int=10_000) -> Dict[IgnoreRes, int]:
+    """
+    Reevaluates and stores ignore decisions for all results in the database, e.g. after changing the filters.
+    Next get_digest will pick them up without having to evaluate anything.
+    """
+    rtype = get_result_type(repo)
+    from_json = JsonTrait.for_(rtype).from_json
+    Ignore = IgnoreTrait.for_(rtype)
+    config = ignore_config(rtype, repo.stem)
+    # decisions refer to the rows by id, so older databases need it first
+    migrate(repo)
+    rh = DbReader(repo)
+    stats: Dict[IgnoreRes, int] = {}
+    decisions: Dict[int, IgnoreRes] = {}
+    for keys in ichunks(rh.row_keys(), n=chunk):
+        rows = list(rh.iter_keyed_rows(keys))
+        reasons = Ignore.reasons(repo.stem, [r.json for r in rows], from_json)
+        for r, reason in zip(rows, reasons):
+            decisions[r.rowid] = reason
+            stats[reason] = stats.get(reason, 0) + 1
+    rh.save_ignores(config, decisions)
+    return stats
+
+
 def slugify_in(path: str, dir: Path):
     dd = os.listdir(str(dir))
     while True:
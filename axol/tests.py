@@ -19,6 +19,42 @@ def test_dbwriter(tmp_path):
     dw.commit(jsons, query='test')
 
 
+def test_db_meta(tmp_path):
+    import pytest
+    from axol.traits import ForHackernews, get_result_type
+    Result = ForHackernews.Target
+    td = Path(tmp_path)
+
+    # name doesn't tell anything about the source
+    db = td / 'whatever.sqlite'
+    dw = DbWriter(db, source='hackernews', schema=Result._fields, queries=['memex', 'lifelogging'])
+    dw.commit([{'uid': '1'}], query='test')
+    meta = DbReader(db).get_meta()
+    assert meta['source' ] == 'hackernews'
+    assert meta['schema' ] == list(Result._fields)
+    assert meta['queries'] == ['memex', 'lifelogging']
+    assert get_result_type(db) is Result
+
+    with pytest.raises(RuntimeError, match='stores hackernews results'):
+        DbWriter(db, source='twitter').commit([{'uid': '2'}], query='test')
+    # nothing was written
+    assert DbReader(db).count() == 1
+
+
+def test_codec_canonical():
+    from collections import OrderedDict
+    from axol.codec import JSON
+    jsons = [
+        {'uid': '1', 'text': 'привет 👋', 'tags': ['b', 'a'], 'likes': 3},
+        {'z': None, 'a': {'y': 1, 'x': 2}, 'uid': '\ud83d'},
+    ]
+    for j in jsons:
+        blob = JSON.encode(j)
+        # must stay the same as legacy encoding, otherwise deduplication breaks
+        assert blob == json.dumps(OrderedDict(sorted(j.items())))
+        assert JSON.decode(blob) == j
+
+
 testrange = list(range(15))
 
 def get_testdata(q):
@@ -90,6 +126,9 @@ def test_crawl(tmp_path):
 
     process_query(q=q, dry=False, path=td)
     assert count(db) == 15
+    meta = DbReader(db).get_meta()
+    assert meta['source' ] == 'pinboard'
+    assert meta['queries'] == ['query1', 'query2']
 
     # TODO meh, sleeps because of timestamping..
     time.sleep(1)
@@ -187,3 +226,779 @@ def test_db_reader():
     from pathlib import Path
     hh = DbReader(Path(RESULTS / 'pinboard_arbtt.sqlite'))
     assert len(list(hh.iter_versions())) > 5
+
+
+def test_blob_formats(tmp_path):
+    pytest.importorskip('msgpack')
+    from datetime import datetime, timedelta, timezone
+    from axol.database import convert, BLOB_META
+    from axol.jsonify import to_json, JsonTrait
+    from axol.twitter import Result
+    td = Path(tmp_path)
+
+    tz = timezone(timedelta(hours=3))
+    tweets = [Result(
+        uid=str(i),
+        when=datetime(year=2020, month=1, day=1, microsecond=i, tzinfo=tz) + timedelta(hours=i),
+        link=f'https://twitter.com/user/status/{i}',
+        text=f'tweet {i} ✓',
+        user='user',
+        replies=i,
+        retweets=0,
+        likes=1,
+    ) for i in range(10)]
+    jsons = [to_json(t) for t in tweets]
+
+    jdb = td / 'twitter_json.sqlite'
+    DbWriter(jdb, source='twitter', schema=Result._fields, queries=['test']).commit(jsons, query='test')
+
+    # name doesn't tell the source, so it has to come from meta
+    mdb = td / 'converted.sqlite'
+    convert(jdb, mdb, blob_format='msgpack')
+    jmeta, mmeta = DbReader(jdb).get_meta(), DbReader(mdb).get_meta()
+    assert mmeta['blob_format'] == 'msgpack'
+    assert {k: v for k, v in mmeta.items() if k not in BLOB_META} == {k: v for k, v in jmeta.items() if k not in BLOB_META}
+    assert mmeta['source'] == 'twitter'
+    from axol.traits import get_result_type
+    assert get_result_type(mdb) is Result
+    jdb2 = td / 'twitter_json2.sqlite'
+    convert(mdb, jdb2, blob_format='json')
+
+    def blobs(db: Path):
+        return check_output(['sqlite3', db, 'select quote(blob) from results']).decode('utf8').splitlines()
+    assert blobs(jdb) == blobs(jdb2)
+
+    from_json = JsonTrait.for_(Result).from_json
+    [(_, _, mjsons)] = list(DbReader(mdb).iter_versions())
+    assert [from_json(j) for j in mjsons] == tweets
+
+    # blobs are deterministic, so deduplication still works
+    DbWriter(mdb, blob_format='msgpack').commit(jsons[5:], query='test')
+    assert count(mdb) == 10
+    fdb = td / 'twitter_fresh.sqlite'
+    # e.g. query didn't return anything on the first crawl, the format is recorded with the first results
+    DbWriter(fdb, blob_format='msgpack').commit([], query='test')
+    DbWriter(fdb, blob_format='msgpack').commit(jsons, query='test')
+    assert DbReader(fdb).get_meta()['blob_format'] == 'msgpack'
+    assert blobs(fdb) == blobs(mdb)
+
+
+def make_hackernews_db(db: Path, revisions: range, per_revision: int=20, seed: int=0) -> None:
+    '''
+    Synthetic database: each revision returns a random mix of previously seen, updated and new items
+    '''
+    import random
+    from datetime import datetime, timedelta, timezone
+    from axol.hackernews import Result
+    from axol.jsonify import to_json
+    rnd = random.Random(seed)
+    start = datetime(year=2020, month=1, day=1, tzinfo=timezone.utc)
+    dw = DbWriter(db)
+    for r in revisions:
+        items = [Result(
+            uid=str(rnd.randint(0, revisions.stop * per_revision // 2)),
+            when=start + timedelta(hours=rnd.randint(0, 1000)),
+            user=f'user{rnd.randint(0, 5)}',
+            url=f'https://example.com/{rnd.randint(0, 100)}',
+            title='title',
+            text=rnd.choice(['', 'spam', 'text']),
+            points=rnd.randint(0, 3),
+            comments=0,
+        ) for _ in range(per_revision)]
+        dw._commit(sha='test', dt=start + timedelta(days=r), jsons=[to_json(i) for i in items], query='test')
+
+
+def test_digest_cache(tmp_path, monkeypatch):
+    td = Path(tmp_path)
+    db = td / 'hackernews_test.sqlite'
+    cache_dir = td / 'cache'
+
+    make_hackernews_db(db, revisions=range(0, 5))
+    first = get_digest(db, cache_dir=cache_dir)
+    assert first.changes == get_digest(db).changes
+
+    make_hackernews_db(db, revisions=range(5, 10))
+    from axol.storage import load_digest_cache, digest_version, db_stamp, DbReader
+    from axol.hackernews import Result
+    [cache_file] = cache_dir.iterdir()
+    assert load_digest_cache(cache_file, version=digest_version(Result, db.stem), rh=DbReader(db), stamp=db_stamp(db)) is not None
+    cached = get_digest(db, cache_dir=cache_dir)
+    fresh  = get_digest(db)
+    assert len(fresh.changes) > len(first.changes)
+    assert cached.changes == fresh.changes
+
+    # same name, different database
+    other = td / 'other' / db.name
+    other.parent.mkdir()
+    make_hackernews_db(other, revisions=range(0, 10), seed=1)
+    assert get_digest(other, cache_dir=cache_dir).changes == get_digest(other).changes
+    assert len(list(cache_dir.iterdir())) == 2
+
+    # database didn't change, so shouldn't even be queried
+    def fail(*args, **kwargs):
+        raise AssertionError
+    monkeypatch.setattr(DbReader, 'latest_revision', fail)
+    assert get_digest(db, cache_dir=cache_dir).changes == fresh.changes
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_digest_first_seen(tmp_path, monkeypatch, seed):
+    from axol.traits import HackernewsIgnore
+    spam = lambda obj: 'spam' if obj.text == 'spam' else None
+    monkeypatch.setattr(HackernewsIgnore, 'ignorer', classmethod(lambda trait, repo: spam))
+
+    td = Path(tmp_path)
+    db = td / 'hackernews_test.sqlite'
+    make_hackernews_db(db, revisions=range(0, 10), seed=seed)
+    fresh = get_digest(db, first_seen=True)
+    scan = get_digest(db, first_seen=False)
+    assert fresh.changes == scan.changes
+    assert fresh.updated == scan.updated
+    assert len(fresh.updated) > 0
+    import axol.storage
+    with monkeypatch.context() as m:
+        m.setattr(axol.storage, 'PARALLEL_THRESHOLD', 0)
+        parallel = get_digest(db, workers=3)
+    assert (parallel.changes, parallel.updated) == (fresh.changes, fresh.updated)
+    everything = [i for items in fresh.changes.values() for i in items]
+    assert len(everything) > 0
+    assert all(i.text != 'spam' for i in everything)
+
+    cache_dir = td / 'cache'
+    get_digest(db, cache_dir=cache_dir)
+    make_hackernews_db(db, revisions=range(10, 15), seed=seed)
+    cached = get_digest(db, cache_dir=cache_dir)
+    scan = get_digest(db, first_seen=False)
+    assert (cached.changes, cached.updated) == (scan.changes, scan.updated)
+
+
+def test_tracked_hashes(tmp_path, monkeypatch):
+    from datetime import datetime, timedelta, timezone
+    import axol.storage
+    from axol.hackernews import Result
+    from axol.jsonify import to_json
+    from axol.traits import UpdateTrait
+    td = Path(tmp_path)
+    tracked = UpdateTrait.for_(Result).tracked
+
+    decoded = []
+    _decoded = axol.storage._decoded
+    def counting(from_json, ignore, row):
+        decoded.append(row.rowid)
+        return _decoded(from_json, ignore, row)
+    monkeypatch.setattr(axol.storage, '_decoded', counting)
+
+    start = datetime(year=2020, month=1, day=1, tzinfo=timezone.utc)
+    def crawl(dw: DbWriter, r: int) -> None:
+        # only points (not tracked) change, apart from a single edit
+        items = [Result(
+            uid=str(i),
+            when=start + timedelta(hours=i),
+            user='user',
+            url=f'https://example.com/{i}',
+            title='title',
+            text='edited' if i == 0 and r >= 25 else 'text',
+            points=r,
+            comments=0,
+        ) for i in range(100)]
+        dw._commit(sha='test', dt=start + timedelta(days=r), jsons=[to_json(i) for i in items], query='test')
+
+    db = td / 'hackernews_hashes.sqlite'
+    dw = DbWriter(db, tracked=tracked)
+    for r in range(50):
+        crawl(dw, r)
+    digest = get_digest(db)
+    assert len(decoded) == 100 + 1 # first seen rows + the edit
+    assert [[i.uid for i in items] for items in digest.updated.values()] == [['0']]
+
+    # older databases without stored hashes: decoded once, then the hashes are stored
+    legacy = td / 'hackernews_legacy.sqlite'
+    dw = DbWriter(legacy)
+    for r in range(50):
+        crawl(dw, r)
+    decoded.clear()
+    assert get_digest(legacy).updated == digest.updated
+    assert len(decoded) == 5000
+    assert DbReader(legacy).hashes_valid(tracked)
+    decoded.clear()
+    assert get_digest(legacy).updated == digest.updated
+    assert len(decoded) == 101
+    # writer picks up the tracked fields from meta
+    before = DbReader(legacy).latest_revision()
+    crawl(DbWriter(legacy), 50)
+    new = DbReader(legacy).row_hashes(tracked, after=before)
+    assert len(new) == 100 and all(h is not None for _, _, _, h in new)
+
+
+def test_stable_rowids(tmp_path):
+    import sqlite3
+    db = Path(tmp_path) / 'hackernews_legacy.sqlite'
+    # schema before the explicit id column
+    with sqlite3.connect(str(db)) as conn:
+        conn.execute('CREATE TABLE results (uid VARCHAR, dt VARCHAR, blob VARCHAR)')
+        conn.executemany('INSERT INTO results VALUES (?, ?, ?)', [(str(i), '2020-01-01', json.dumps({'uid': str(i)})) for i in range(10)])
+        conn.execute("DELETE FROM results WHERE uid IN ('2', '3', '4')")
+    conn.close()
+
+    def schema():
+        with sqlite3.connect(str(db)) as conn:
+            return list(conn.execute('SELECT name, sql FROM sqlite_master'))
+    legacy = schema()
+
+    rh = DbReader(db)
+    keys = rh.row_keys()
+    assert [(rowid, uid) for rowid, uid, _ in keys] == [(1, '0'), (2, '1'), (6, '5'), (7, '6'), (8, '7'), (9, '8'), (10, '9')]
+    # reading doesn't migrate the database, and the decisions aren't stored since rowids aren't stable yet
+    assert [r.uid for r in rh.iter_keyed_rows(keys, ignore_config='config')] == [uid for _, uid, _ in keys]
+    assert rh.get_meta() == {} and not rh.hashes_valid(['text'])
+    rh.save_ignores('config', {rowid: f'reason {uid}' for rowid, uid, _ in keys})
+    assert schema() == legacy
+
+    from axol.database import migrate
+    migrate(db)
+    assert schema() != legacy
+    assert rh.row_keys() == keys
+    rh.save_ignores('config', {rowid: f'reason {uid}' for rowid, uid, _ in keys})
+
+    conn = sqlite3.connect(str(db))
+    conn.execute('VACUUM')
+    conn.close()
+    assert rh.row_keys() == keys
+    assert [(r.uid, r.reason) for r in rh.iter_keyed_rows(keys, ignore_config='config')] == [(uid, f'reason {uid}') for _, uid, _ in keys]
+
+
+def test_digest_store(tmp_path, monkeypatch):
+    import sqlite3
+    from axol.storage import db_stamp
+    from axol.traits import HackernewsIgnore
+    spam = lambda obj: 'spam' if obj.text == 'spam' else None
+    monkeypatch.setattr(HackernewsIgnore, 'ignorer', classmethod(lambda trait, repo: spam))
+
+    td = Path(tmp_path)
+    db = td / 'hackernews_test.sqlite'
+    make_hackernews_db(db, revisions=range(0, 5))
+    expected = get_digest(db, store=False)
+
+    # e.g. crawler is writing into it
+    conn = sqlite3.connect(str(db), isolation_level=None)
+    conn.execute('BEGIN IMMEDIATE')
+    stamp = db_stamp(db)
+    assert get_digest(db).changes == expected.changes
+    conn.execute('ROLLBACK')
+    conn.close()
+    assert db_stamp(db) == stamp
+
+    assert get_digest(db, store=False).changes == expected.changes
+    assert db_stamp(db) == stamp
+    assert get_digest(db).changes == expected.changes
+    assert db_stamp(db) != stamp
+
+
+def test_collector_spill(tmp_path, monkeypatch):
+    import pickle
+    from collections import namedtuple
+    from axol.storage import Collector
+    I = namedtuple('I', ['uid'])
+    cc = Collector(spill_threshold=3)
+    assert cc.register([I('a'), I('b'), I('a')]) == [I('a'), I('b')]
+    assert cc.register([I(str(i)) for i in range(10)]) == [I(str(i)) for i in range(10)]
+    assert cc.register([I('b'), I('5'), I('x')]) == [I('x')]
+    assert len(cc) == 13 and cc._spilled is not None
+    cc2 = pickle.loads(pickle.dumps(cc))
+    assert set(cc2) == set(cc)
+    assert 'a' in cc2 and '9' in cc2 and 'y' not in cc2
+
+    J = namedtuple('J', ['uid', 'text'])
+    cc = Collector(spill_threshold=1, tracked=['text'])
+    cc.register([J('a', 'x'), J('b', 'y')])
+    assert not cc.update(J('a', 'x'))
+    assert cc.update(J('a', 'z')) # spilled
+    assert not cc.update(J('a', 'z'))
+    assert cc.update(J('b', 'z'))
+    assert len(cc) == 2
+
+    # spilling shouldn't change the digest
+    td = Path(tmp_path)
+    db = td / 'hackernews_test.sqlite'
+    make_hackernews_db(db, revisions=range(0, 10))
+    expected = get_digest(db)
+    monkeypatch.setattr('axol.storage.SPILL_THRESHOLD', 10)
+    for d in [get_digest(db), get_digest(db, first_seen=False)]:
+        assert (d.changes, d.updated) == (expected.changes, expected.updated)
+
+
+def test_excluder():
+    from collections import namedtuple
+    from axol.filters import Excluder, Subreddit, Contains
+    I = namedtuple('I', ['title', 'description', 'subreddit'])
+    filters = [Subreddit('gaming'), Subreddit('.*gun.*'), Contains('pokemon'), Contains(' guns '), Subreddit('gaming'), Contains('gaming')]
+    ex = Excluder(filters)
+    items = [
+        I('title', None, 'lifelogging'),
+        I('title', None, 'Gaming'),
+        I('Pokemon go', 'text', 'shotguns'),
+        I('I love Pokemon', None, 'pkm'),
+        I('about', 'guns and', 'guns'),
+        I('NoneType', 'none', 'None'),
+    ]
+    expected = [next((f.reason for f in filters if f.matches(i)), None) for i in items]
+    assert expected == [None, 'subreddit gaming', 'subreddit .*gun.*', 'contains pokemon', 'subreddit .*gun.*', None]
+    assert [ex.reason(i) for i in items] == expected
+    assert ex.filters == filters[:4] + [Contains('gaming')]
+
+    # exclusions only apply to the repo of the query that declared them
+    from config import get_reddit_queries, get_reddit_excluder
+    [pkm] = [q for q in get_reddit_queries() if len(q.excluded) > 0 and q.qname == 'pkm']
+    [other] = [q for q in get_reddit_queries() if q.qname == 'memex']
+    gaming = I('title', None, 'gaming')
+    assert get_reddit_excluder(pkm.repo_name).reason(gaming) == 'subreddit gaming'
+    assert get_reddit_excluder(other.repo_name).reason(gaming) is None
+    assert get_reddit_excluder('reddit_unknown').reason(gaming) is None
+
+
+def test_ignore_decisions(tmp_path, monkeypatch):
+    from axol.traits import HackernewsIgnore
+    calls = []
+    def ignore(obj):
+        calls.append(obj.uid)
+        return 'spam' if obj.text == 'spam' else None
+    monkeypatch.setattr(HackernewsIgnore, 'ignorer', classmethod(lambda trait, repo: ignore))
+    monkeypatch.setattr(HackernewsIgnore, 'reasons', classmethod(lambda trait, repo, jsons, from_json: [ignore(from_json(j)) for j in jsons]))
+
+    db = Path(tmp_path) / 'hackernews_test.sqlite'
+    make_hackernews_db(db, revisions=range(0, 10))
+    fresh = get_digest(db)
+    assert len(calls) > 0
+
+    # decisions are stored in the database now
+    calls.clear()
+    cached = get_digest(db)
+    assert (cached.changes, cached.updated) == (fresh.changes, fresh.updated)
+    assert len(calls) == 0
+
+    # config changed, so need to reevaluate
+    monkeypatch.setattr(HackernewsIgnore, 'config', classmethod(lambda trait, repo: 'changed'))
+    again = get_digest(db)
+    assert (again.changes, again.updated) == (fresh.changes, fresh.updated)
+    assert len(calls) > 0
+
+    # batch reevaluation, e.g. after changing the filters
+    from axol.storage import rescan_ignores
+    monkeypatch.setattr(HackernewsIgnore, 'config', classmethod(lambda trait, repo: 'changed again'))
+    stats = rescan_ignores(db)
+    assert stats['spam'] > 0 and sum(stats.values()) == DbReader(db).count()
+    calls.clear()
+    rescanned = get_digest(db)
+    assert (rescanned.changes, rescanned.updated) == (fresh.changes, fresh.updated)
+    assert len(calls) == 0
+
+
+def test_pipeline():
+    from collections import namedtuple
+    from axol.filters import Pipeline, query_filters
+    from axol.queries import TwitterQ
+    I = namedtuple('I', ['user', 'text'])
+    q = TwitterQ('memex', 'memex')
+    assert q.excluded == query_filters('"memex"')
+    assert TwitterQ('emind', '"extended mind"').excluded == []
+
+    p = Pipeline(q.excluded)
+    items = [
+        I('karlicoss', 'Memex is great'),
+        I('MemexFan' , 'memex is great'),
+        I('karlicoss', '@memex_fan thanks!'),
+        I('karlicoss', 'mem_ex'),
+    ]
+    expected = [None, 'user contains memex', 'mentions memex', 'lacks memex']
+    assert [p.reason(i) for i in items] == expected
+    assert p.reasons(items) == expected
+    import operator
+    assert p.reasons([i._asdict() for i in items], get=operator.getitem) == expected
+
+
+def test_trait():
+    import axol.trait
+    axol.trait.test()
+
+
+def test_report_incremental(tmp_path):
+    from argparse import ArgumentParser
+    from axol.report import run, setup_parser, load_manifest
+    td = Path(tmp_path)
+    db = td / 'hackernews_test.sqlite'
+    odir = td / 'output'
+    make_hackernews_db(db, revisions=range(0, 3))
+
+    def report(force=False, *extra):
+        p = ArgumentParser()
+        setup_parser(p)
+        # NOTE: absolute path overrides DATABASES
+        run(p.parse_args([
+            str(db), '--output-dir', str(odir), '--cache-dir', str(td / 'cache'),
+            *(['--force'] if force else []),
+            *extra,
+        ]))
+    out = odir / 'rendered' / 'hackernews_test.html'
+    def mtime() -> int:
+        return out.stat().st_mtime_ns
+
+    report()
+    [entry] = load_manifest(odir).values()
+    assert entry['revision'] == DbReader(db).latest_revision()
+    first = mtime()
+
+    time.sleep(0.01)
+    report()
+    assert mtime() == first # nothing changed
+
+    make_hackernews_db(db, revisions=range(3, 5), seed=1)
+    report()
+    second = mtime()
+    assert second > first
+    [entry] = load_manifest(odir).values()
+    assert entry['revision'] == DbReader(db).latest_revision()
+
+    time.sleep(0.01)
+    report(force=True)
+    assert mtime() > second
+
+    # output was tampered with
+    out.write_text('whatever')
+    report()
+    assert 'whatever' not in out.read_text()
+
+    # user summary wasn't requested before, so has to be rendered even though nothing changed
+    users = odir / 'hackernews_users.html'
+    assert not users.exists()
+    report(False, '--with-user-summary')
+    assert users.exists()
+
+    # switching the formatter rerenders
+    third = mtime()
+    time.sleep(0.01)
+    report(False, '--formatter', 'template')
+    assert mtime() > third
+
+
+@pytest.mark.parametrize('sidebar', [True, False])
+@pytest.mark.parametrize('nblocks', [0, 3])
+def test_stream_document(sidebar, nblocks):
+    import io
+    import dominate
+    import dominate.tags as T
+    from axol.core.kdominate import stream_document
+
+    def make():
+        doc = dominate.document(title='test')
+        with doc.head:
+            T.style('body {}')
+        if sidebar:
+            with doc:
+                with T.div(id='sidebar'):
+                    T.label('label', for_='x')
+        return doc
+
+    def blocks():
+        for i in range(nblocks):
+            with T.div(cls='day-changes') as block:
+                T.b(f'day {i}')
+                with T.div(cls='inner'):
+                    T.div('item <escaped>', cls='item')
+            yield block
+
+    doc = make()
+    doc.add(*blocks())
+    expected = str(doc)
+
+    fo = io.StringIO()
+    stream_document(make(), fo, blocks())
+    assert fo.getvalue() == expected
+
+
+def test_fragment_cache(tmp_path):
+    import re
+    import sqlite3
+    from axol.fragments import FragmentCache
+    from axol.report import render_latest
+    td = Path(tmp_path)
+    db = td / 'hackernews_test.sqlite'
+    make_hackernews_db(db, revisions=range(0, 5))
+    digest = get_digest(db)
+
+    def render(cache_dir):
+        out = render_latest(db, digest=digest, rendered=td / 'rendered', cache_dir=cache_dir)
+        return re.sub(r'rendered at [^<]*', '', out.read_text())
+
+    uncached = render(None)
+    assert render(td / 'cache') == uncached
+    cf = td / 'cache' / 'hackernews_test.sqlite.fragments'
+    assert cf.exists()
+    assert render(td / 'cache') == uncached # spliced from the cache
+
+    calls = []
+    def make():
+        calls.append(1)
+        return 'html'
+    fc = FragmentCache(cf, version='test')
+    [(count,)] = fc.conn.execute('SELECT COUNT(*) FROM fragments')
+    assert count == 0 # different version
+    assert fc.render('key', make) == 'html'
+    assert fc.render('key', make) == 'html'
+    assert (fc.hits, fc.misses, len(calls)) == (1, 1, 1)
+    fc.save()
+    fc = FragmentCache(cf, version='test')
+    assert fc.render('key', make) == 'html'
+    assert (fc.hits, fc.misses, len(calls)) == (1, 0, 1)
+    fc.save()
+
+    # fragments which weren't used during the run are dropped
+    fc = FragmentCache(cf, version='test')
+    fc.render('other', make)
+    fc.save()
+    fc = FragmentCache(cf, version='test')
+    fc.render('key', make)
+    assert (fc.hits, fc.misses, len(calls)) == (0, 1, 3)
+
+    fc.close()
+
+    # e.g. pickled cache from the older versions
+    cf.write_bytes(b'garbage' * 100)
+    with FragmentCache(cf, version='test') as fc:
+        assert fc.render('key', make) == 'html'
+    with pytest.raises(sqlite3.ProgrammingError):
+        fc.render('key', make) # closed
+
+
+def test_render_archive(tmp_path, monkeypatch):
+    from axol.hackernews import Result
+    from axol.report import render_latest, link_groups, month_groups, month_of
+    # so different items can share the link and end up in the same group
+    monkeypatch.setattr(Result, 'link', property(lambda r: r.url))
+    td = Path(tmp_path)
+    db = td / 'hackernews_test.sqlite'
+    rendered = td / 'rendered'
+    make_hackernews_db(db, revisions=range(0, 70)) # jan, feb and beginning of march
+
+    def render():
+        digest = get_digest(db)
+        render_latest(db, digest=digest, rendered=rendered)
+        return digest
+
+    digest = render()
+    adir = rendered / 'hackernews_test'
+    jan, feb = adir / '2020-01.html', adir / '2020-02.html'
+    recent = (rendered / 'hackernews_test.html').read_text()
+    assert '01 Jan 2020' in jan.read_text()
+    assert '01 Jan 2020' not in recent
+    assert '2020-01.html' in recent
+    # nothing is lost
+    everything = recent + jan.read_text() + feb.read_text()
+    for items in digest.changes.values():
+        for i in items:
+            assert i.link in everything
+    # later occurrences of a group end up in the archive for the month they happened in
+    groups, _ = link_groups(digest)
+    assert any(len({month_of(d) for d, _ in g}) > 1 for g in groups)
+    for g in groups:
+        for o in g:
+            assert any(o in mg for mgs in month_groups(groups, month_of(o[0])).values() for mg in mgs)
+
+    mtimes = [jan.stat().st_mtime_ns, feb.stat().st_mtime_ns]
+    make_hackernews_db(db, revisions=range(70, 75), seed=1)
+    render()
+    # past months are never rewritten
+    assert [jan.stat().st_mtime_ns, feb.stat().st_mtime_ns] == mtimes
+
+
+def test_feed(tmp_path, monkeypatch):
+    import re
+    from axol.hackernews import Result
+    from axol.report import render_latest, FeedLimits
+    # so different items can share the link and end up in the same group
+    monkeypatch.setattr(Result, 'link', property(lambda r: r.url))
+    td = Path(tmp_path)
+    db = td / 'hackernews_test.sqlite'
+    cache_dir = td / 'cache'
+    limits = FeedLimits(entries=30, days=None)
+
+    def entry_ids(cache_dir, limits=limits):
+        rendered = td / 'rendered'
+        render_latest(db, digest=get_digest(db), rendered=rendered, cache_dir=cache_dir, feed=limits)
+        atom = (rendered / 'atom' / 'hackernews_test.xml').read_text()
+        return re.findall(r'<id>(\d+)</id>', atom)
+
+    make_hackernews_db(db, revisions=range(0, 10))
+    first = entry_ids(cache_dir)
+    assert len(first) == 30
+    assert (cache_dir / 'hackernews_test.sqlite.feed').exists()
+
+    def entries(cache_dir):
+        entry_ids(cache_dir)
+        atom = (td / 'rendered' / 'atom' / 'hackernews_test.xml').read_text()
+        return [re.sub(r'<updated>.*?</updated>', '', e) for e in re.findall(r'<entry>.*?</entry>', atom, flags=re.DOTALL)]
+
+    make_hackernews_db(db, revisions=range(10, 12), seed=1)
+    second = entry_ids(cache_dir)
+    assert len(second) == 30
+    assert second != first
+    # incremental feed is the same as the one generated from scratch
+    assert second == entry_ids(None)
+
+    # new items with links which are already in the feed
+    make_hackernews_db(db, revisions=range(12, 13), seed=2)
+    assert entries(cache_dir) == entries(None)
+
+    assert len(entry_ids(None, limits=FeedLimits(entries=1000, days=2))) < len(entry_ids(None, limits=FeedLimits(entries=1000, days=None)))
+
+    # state built with the old limits isn't reused
+    more = FeedLimits(entries=50, days=None)
+    assert entry_ids(cache_dir, limits=more) == entry_ids(None, limits=more)
+    assert len(entry_ids(cache_dir, limits=more)) == 50
+
+
+def test_do_repo(tmp_path, monkeypatch):
+    import axol.report as R
+    td = Path(tmp_path)
+    db = td / 'hackernews_test.sqlite'
+    make_hackernews_db(db, revisions=range(0, 3))
+
+    calls = []
+    def counting(*args, **kwargs):
+        calls.append(args)
+        return get_digest(*args, **kwargs)
+    monkeypatch.setattr(R, 'get_digest', counting)
+    res = R.do_repo(db, output_dir=td / 'output', last=None, summary=True)
+    assert len(calls) == 1
+    assert all(p.exists() for p in res)
+    assert [p.suffix for p in res] == ['.html', '.xml', '.html']
+    from axol.adhoc import summary_output
+    assert summary_output(res, td / 'output') == td / 'output' / 'summary' / 'hackernews_test.html'
+
+
+@pytest.mark.parametrize('jobs', [['--serial'], ['--jobs', '2'], ['--threads', '--jobs', '4']])
+def test_report_jobs(tmp_path, capsys, jobs):
+    from argparse import ArgumentParser
+    from axol.report import run, setup_parser
+    td = Path(tmp_path)
+    small = td / 'hackernews_small.sqlite'
+    large = td / 'hackernews_large.sqlite'
+    make_hackernews_db(small, revisions=range(0, 2))
+    make_hackernews_db(large, revisions=range(0, 10))
+    odir = td / 'output'
+
+    p = ArgumentParser()
+    setup_parser(p)
+    run(p.parse_args([str(small), str(large), '--output-dir', str(odir), '--cache-dir', str(td / 'cache'), '--with-summary', *jobs]))
+    for name in ['hackernews_small', 'hackernews_large']:
+        assert (odir / 'rendered' / f'{name}.html').exists()
+        assert (odir / 'rendered' / 'atom' / f'{name}.xml').exists()
+        assert (odir / 'summary' / f'{name}.html').exists()
+
+    out = capsys.readouterr().out
+    rows = [l.split() for l in out.splitlines() if l.startswith('hackernews_')]
+    assert sorted((r, k) for r, k, _ in rows) == sorted(
+        (r, k) for r in ['hackernews_large', 'hackernews_small'] for k in ['digest', 'history', 'atom', 'summary']
+    )
+
+
+def test_format_threads():
+    from concurrent.futures import ThreadPoolExecutor
+    from axol.benchmarks import sources, synthetic
+    from axol.report import FormatTrait
+    for name, rtype in sources():
+        Format = FormatTrait.for_(rtype)
+        groups = [[(None, i)] for i in synthetic(rtype, 500)]
+        render = lambda g: str(Format.format(g))
+        serial = [render(g) for g in groups]
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            assert list(pool.map(render, groups)) == serial, name
+
+
+@pytest.mark.parametrize('level', [0, 3])
+def test_template_formatters(level: int):
+    from axol.benchmarks import sources, synthetic
+    from axol.report import get_format
+    for name, rtype in sources():
+        items = list(synthetic(rtype, 300))
+        # some values that need escaping and empty/zero values, which are formatted differently
+        items = [
+            i._replace(**{
+                f: (v + ' <&"\'>' if k % 2 == 0 else v) if isinstance(v, str) and f not in ('link', 'blink') else
+                   (k % 3       if k % 4 == 0 else v) if isinstance(v, int) else
+                   v
+                for f, v in i._asdict().items()
+            })
+            for k, i in enumerate(items)
+        ]
+        items = [
+            i._replace(**{f: v for f, v in [('description', ' '), ('url', None)] if f in rtype._fields}) if k % 5 == 0 else i
+            for k, i in enumerate(items)
+        ]
+        groups = [[(None, i)] for i in items]
+        if 'link' in rtype._fields:
+            groups.extend([(None, i._replace(link=items[k].link)) for i in items[k: k + 3]] for k in range(0, len(items), 3))
+        Dom, Template = get_format(rtype, 'dom'), get_format(rtype, 'template')
+        for g in groups:
+            dom = ''.join(Dom     .format(g)._render([], level, '  ', True, False))
+            tpl = ''.join(Template.format(g)._render([], level, '  ', True, False))
+            assert dom == tpl, name
+
+
+def test_summarise():
+    from datetime import datetime, timedelta, timezone
+    from axol.benchmarks import synthetic
+    from axol.report import CumulativeBase
+    from axol.traits import ForSpinboard, ForHackernews
+
+    rtype = ForSpinboard.Target
+    Cumulative = CumulativeBase.for_(rtype)
+    start = datetime(year=2020, month=1, day=1, tzinfo=timezone.utc)
+    [a, b, c, d] = synthetic(rtype, 4)
+    a = a._replace(link='https://example.com/x' , title='one', when=start + timedelta(days=2), user='u2', tags=['t1'])
+    b = b._replace(link='https://example.com/x/', title='two', when=start + timedelta(days=1), user='u1', tags=['t2', 'T1'])
+    c = c._replace(link='https://example.com/x' , title='two', when=start + timedelta(days=3), user='u2', tags=[])
+    d = d._replace(link='https://example.com/y' ,              when=start + timedelta(days=5))
+    [y, x] = Cumulative.summarise([a, b, c, d])
+    assert y.items == [d]
+    assert x.items == [a, b, c]
+    assert x.link  == 'https://example.com/x'
+    assert x.title == 'two'
+    assert x.when  == b.when
+    assert x.users == ['u1', 'u2']
+    assert x.tags  == ['t1', 't2']
+
+    # highest score first, then most recent
+    rtype = ForHackernews.Target
+    Cumulative = CumulativeBase.for_(rtype)
+    items = list(synthetic(rtype, 1000))
+    summaries = Cumulative.summarise(items)
+    assert len(summaries) == len(items)
+    keys = [(s.score, s.when) for s in summaries]
+    assert keys == sorted(keys, reverse=True)
+    assert summaries[0].score == max(i.points + i.comments for i in items)
+
+
+def test_decoder_interning():
+    from axol.benchmarks import synthetic
+    from axol.jsonify import JsonTrait, to_json
+    from axol.traits import ForSpinboard
+    Trait = JsonTrait.for_(ForSpinboard.Target)
+    jsons = [{**to_json(i), 'tags': ['a', 'b']} for i in synthetic(ForSpinboard.Target, 10)]
+
+    decode = Trait.decoder()
+    [x, y] = [decode(j) for j in jsons[:2]]
+    assert x.tags is y.tags # shared within the pass
+    [z] = [Trait.decoder()(j) for j in jsons[2:3]]
+    assert z.tags == x.tags and z.tags is not x.tags # but not across passes
+    # process wide from_json doesn't hold onto anything
+    assert Trait.from_json(jsons[0]).tags is not Trait.from_json(jsons[1]).tags
+
+
+def test_no_nested_pools():
+    from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+    from axol.storage import _can_fork
+    assert _can_fork()
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        assert not pool.submit(_can_fork).result()
+    with ProcessPoolExecutor(max_workers=1) as pool:
+        assert not pool.submit(_can_fork).result()
@@ -1,4 +1,4 @@
-from typing import Dict, Type, Dict, Any
+from typing import Callable, Dict, List, Type, Dict, Any
 
 from .core.common import classproperty
 
@@ -20,6 +20,8 @@ class AbsTrait:
     def reg(cls, *traits: Type['AbsTrait']) -> None:
         for tr in traits:
             cls._impls[tr.Target] = tr # TODO check for existence?
+        for cache in _dispatch_caches:
+            cache.clear()
 
     @classmethod
     def for_(cls, f): # TODO returns AbsTrait??
@@ -27,10 +29,20 @@ class AbsTrait:
             f = type(f)
         return cls._impls[f]
 
+# type -> resolved method, for each pulled method. NOTE: the method is resolved on the first call, so monkey patching has to happen before that
+_dispatch_caches: List[Dict[Type, Callable]] = []
+
 def pull2(Trait, name):
+    cache: Dict[Type, Callable] = {}
+    _dispatch_caches.append(cache)
     def _m(obj, *args, **kwargs):
-        Dispatched = Trait.for_(obj)
-        return getattr(Dispatched, name)(obj, *args, **kwargs)
+        tp = type(obj)
+        m = cache.get(tp)
+        if m is None:
+            m = getattr(Trait.for_(obj), name)
+            if not isinstance(obj, type): # for_ dispatches on the class itself in this case
+                cache[tp] = m
+        return m(obj, *args, **kwargs)
     return _m
 
 
@@ -136,3 +148,12 @@ def test():
 
     assert safe_int(aa) == 123
     assert safe_int(ll) == None
+
+    # dispatch is cached, but reg invalidates it
+    class ShowA2(ForA, ShowTrait):
+        @classmethod
+        def show(trait, obj, *args, **kwargs):
+            return 'A2'
+    ShowTrait.reg(ShowA2)
+    assert show(aa) == 'A2'
+    assert show(A) == 'A2' # also works for types
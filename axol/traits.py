@@ -1,10 +1,13 @@
+import operator
+from functools import lru_cache
 from pathlib import Path
-from typing import Optional, Type
+from typing import Any, Callable, List, Optional, Sequence, Type
 
 from .trait import AbsTrait, pull
-from .core.common import classproperty, the
+from .common import logger
+from .core.common import classproperty, the, Json
 
-from config import ignored_reddit
+from config import ignored_reddit, get_reddit_excluder, get_pipeline
 
 
 # TODO move target separately?
@@ -55,6 +58,7 @@ class ForHackernews:
 
 Fors = [ForSpinboard, ForReach, ForTentacle, ForTwitter, ForHackernews]
 
+@lru_cache(None)
 def For(res):
     return the([F for F in Fors if res == F.Target])
 
@@ -74,6 +78,23 @@ class IgnoreTrait(AbsTrait):
     @classmethod
     def ignore(trait, obj, *args, **kwargs) -> IgnoreRes:
         return None
+
+    # ignore function for items from the specific repo, looked up once per database
+    @classmethod
+    def ignorer(trait, repo: str) -> Callable[[Any], IgnoreRes]:
+        return trait.ignore
+
+    # same as ignorer, but for many items at once
+    # takes jsons, so implementations that don't need the whole item can skip decoding it
+    @classmethod
+    def reasons(trait, repo: str, jsons: Sequence[Json], from_json: Callable[[Json], Any]) -> List[IgnoreRes]:
+        ignore = trait.ignorer(repo)
+        return [ignore(from_json(j)) for j in jsons]
+
+    # whatever ignore decisions for the repo depend on; used to invalidate caches when config changes
+    @classmethod
+    def config(trait, repo: str) -> str:
+        return ''
 ignore_result = pull(IgnoreTrait.ignore)
 
 
@@ -90,38 +111,101 @@ class TentacleIgnore(ForTentacle, IgnoreTrait):
     pass
 
 class ReachIgnore(ForReach, IgnoreTrait):
+    # NOTE: without the repo, applies filters from all queries
     @classmethod
-    def ignore(trait, obj, *args, **kwargs) -> IgnoreRes:
+    def ignore(trait, obj, *args, repo: Optional[str]=None, **kwargs) -> IgnoreRes:
         # TODO eh, I def. need to separate in different files; that way I can have proper autocompletion..
-        return ignored_reddit(obj)
+        return ignored_reddit(obj, repo=repo)
+
+    # only filters declared by the query the repo belongs to
+    @classmethod
+    def ignorer(trait, repo: str) -> Callable[[Any], IgnoreRes]:
+        return get_reddit_excluder(repo).reason
+
+    @classmethod
+    def config(trait, repo: str) -> str:
+        return repr(get_reddit_excluder(repo).filters)
+
+# postfiltering pipeline, declared by the queries in config
+class PipelineIgnore(IgnoreTrait):
+    @classmethod
+    def ignore(trait, obj, *args, repo: Optional[str]=None, **kwargs) -> IgnoreRes:
+        return None if repo is None else get_pipeline(repo).reason(obj)
+
+    @classmethod
+    def ignorer(trait, repo: str) -> Callable[[Any], IgnoreRes]:
+        return get_pipeline(repo).reason
+
+    # NOTE: filters only look at plain fields, so no need to decode
+    @classmethod
+    def reasons(trait, repo: str, jsons: Sequence[Json], from_json: Callable[[Json], Any]) -> List[IgnoreRes]:
+        return get_pipeline(repo).reasons(jsons, get=operator.getitem)
 
-# TODO FIXME default impls?
-class TwitterIgnore(ForTwitter, IgnoreTrait):
+    @classmethod
+    def config(trait, repo: str) -> str:
+        return repr(get_pipeline(repo).filters)
+
+class TwitterIgnore(ForTwitter, PipelineIgnore):
     pass
 
-class HackernewsIgnore(ForHackernews, IgnoreTrait):
+class HackernewsIgnore(ForHackernews, PipelineIgnore):
     pass
 
 # TODO FIXME could register at the time of inheritance?
 IgnoreTrait.reg(SpinboardIgnore, TentacleIgnore, ReachIgnore, TwitterIgnore, HackernewsIgnore)
 
 
+class UpdateTrait(AbsTrait):
+    # if any of these change for an already reported item, it's reported as updated
+    tracked: Sequence[str] = ()
 
-# TODO maybe, return For directly?
-# TODO FIXME duplication with queries..
-def get_result_type(repo: Path) -> Type:
+class SpinboardUpdate(ForSpinboard, UpdateTrait):
+    tracked = ('title', 'description', 'tags')
+
+class ReachUpdate(ForReach, UpdateTrait):
+    # NOTE: not ups/downs, they change all the time
+    tracked = ('title', 'description')
+
+class TentacleUpdate(ForTentacle, UpdateTrait):
+    tracked = ('description', 'stars')
+
+class TwitterUpdate(ForTwitter, UpdateTrait):
+    tracked = ('text',)
+
+class HackernewsUpdate(ForHackernews, UpdateTrait):
+    tracked = ('title', 'text')
+
+UpdateTrait.reg(SpinboardUpdate, ReachUpdate, TentacleUpdate, TwitterUpdate, HackernewsUpdate)
+
+
+
+def for_source(source: str):
+    return the([F for F in Fors if F.name == source])
+
+
+# legacy databases written before source was stored in meta
+def _guess_for(repo: Path):
     name = repo.name
-    # TODO this could also be a trait?
-    if name.startswith('reddit'):
-        return ForReach.Target
-    elif name.startswith('github'):
-        return ForTentacle.Target
-    elif name.startswith('twitter'):
-        return ForTwitter.Target
-    elif name.startswith('hackernews'):
-        return ForHackernews.Target # TODO meh..
-    elif name.startswith('pinboard'):
-        return ForSpinboard.Target
-    else:
-        # TODO remove this?
-        return ForSpinboard.Target
+    for F in Fors:
+        if name.startswith(F.name):
+            return F
+    logger.warning("%s: couldn't determine the source, assuming %s", repo, ForSpinboard.name)
+    return ForSpinboard
+
+
+@lru_cache(None)
+def for_repo(repo: Path):
+    from .database import DbReader
+    meta = DbReader(repo).get_meta()
+    source = meta.get('source')
+    if source is None:
+        return _guess_for(repo)
+    F = for_source(source)
+    schema = meta.get('schema')
+    if schema is not None and schema != list(F.Target._fields):
+        logger.warning('%s: stored schema %s differs from %s', repo, schema, F.Target._fields)
+    return F
+
+
+def get_result_type(repo: Path) -> Type:
+    return for_repo(repo).Target
@@ -12,7 +12,6 @@
 from datetime import datetime
 import json
 from pathlib import Path
-import re
 import logging
 from typing import List, NamedTuple, Iterable
 
@@ -97,36 +96,22 @@ class TwitterSearch:
                 text = t['tweet']
                 lang = t.get('language')
 
+                # NOTE: only filtering on metadata that isn't stored in the database here
+                # the rest is postfiltered via query_filters (see TwitterQ), so it can be reapplied to stored results
                 if lang in IGNORE_LANGUAGES:
                     continue
 
-                # TODO would be nice to apply this both to the db (at least before rendering)
-                # so could work retrospectively
-
                 # one annoying thing is that if the username contains the query, it's gonna return all results
-                # still annoying that it's even retrieved... not sure what to do with it; again, iterative search would help
-                # seems that even twitter staff suggest to postfilter
-                # https://twittercommunity.com/t/exclude-username-when-searching/10653/3
                 sq = query.strip("'").strip('""').lower()
-                # TODO cli interface should be exact by default? not sure
                 if ' ' not in sq: # hacky way to check that it's single worded?
-                    # TODO log this? gonna be too spammy, maybe once per user
                     # NOTE: in reply, the usernames *are* in the tweet body, so need to check metdata:
                     reply_to_s = ' '.join(x.get('screen_name', '') + '_' + x.get('name', '') for x in t.get('reply_to', []))
                     if any(sq in x.lower() for x in (
-                            user,
                             t.get('name', ''),
                             reply_to_s,
                         )):
                             continue
                             # todo warn somehow? maybe at least a summary
-                    # NOTE ^^ aaand.. this is still not enough because if the user was deleted it's not ending up in 'reply_to'...
-                    if re.search(fr'@[0-9a-z_]*{re.escape(sq)}', text.lower()):
-                        continue
-
-                    # shit. it's really quite fuzzy, e.g. 'memex' might match the username 'mem_ex'. jesus!
-                    if sq not in text.lower():
-                        continue
 
                 when = datetime.strptime(
                     t['created_at'][:len('2020-11-30 01:24:27')] + ' ' + t['timezone'],
@@ -3,6 +3,7 @@ import re
 from typing import List, Iterator, NamedTuple, Type, Any, Sequence
 
 from axol.common import Query, slugify
+from axol.filters import Subreddit, Contains, Excluder, Pipeline
 from axol.queries import GithubQ, pinboard_quote, RedditQ, TwitterQ, PinboardQ, HackernewsQ, filter_queries
 
 from more_itertools import flatten
@@ -12,6 +13,7 @@ BASE_DIR = Path(__file__).absolute().parent; assert BASE_DIR.exists()
 DATABASES   = BASE_DIR / 'databases'
 RESULTS     = DATABASES # TODO deprecate 'databases'?
 REPORTS_DIR = BASE_DIR / 'reports'
+CACHE_DIR   = BASE_DIR / 'cache'
 
 from private_config import *
 
@@ -32,28 +34,6 @@ def gen_pintags(query: str) -> List[str]:
     ])))
 
 
-class Subreddit(NamedTuple):
-    regex: str
-
-    def matches(self, item) -> bool:
-        return re.fullmatch(self.regex, item.subreddit, re.I) is not None
-
-    @property
-    def reason(self) -> str:
-        return f'subreddit {self.regex}'
-
-class Contains(NamedTuple):
-    seq: str
-
-    def matches(self, item) -> bool:
-        xx = f'{item.title} {item.description} {item.subreddit}'.lower()
-        return self.seq in xx
-
-    @property
-    def reason(self) -> str:
-        return f'contains {self.seq}'
-
-
 sub = Subreddit
 
 def subreddit(*subs):
@@ -367,15 +347,21 @@ def get_reddit_queries():
     return res
 
 from typing import Optional
-def ignored_reddit(item) -> Optional[str]:
-    for q in get_reddit_queries():
-        # TODO eh. might need a quicker way to ignore....
-        for ex in q.excluded:
-            # TODO the item itself knows how to match
-            if ex.matches(item):
-                return ex.reason
-    return None
+# index from repo name to the filters declared by its queries; without the repo, filters from all queries
+@lru_cache(None)
+def get_reddit_excluder(repo: Optional[str]=None) -> Excluder:
+    queries = [q for q in get_reddit_queries() if repo is None or q.repo_name == repo]
+    return Excluder([ex for q in queries for ex in q.excluded])
+
+def ignored_reddit(item, repo: Optional[str]=None) -> Optional[str]:
+    return get_reddit_excluder(repo).reason(item)
+
 
+# postfiltering for twitter/HN
+@lru_cache(None)
+def get_pipeline(repo: str) -> Pipeline:
+    queries = [q for q in get_queries() if q.repo_name == repo]
+    return Pipeline([ex for q in queries for ex in q.excluded])
 
 if __name__ == '__main__':
     for q in get_queries():